@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Benchmarks for the rendering pipeline, e.g. `./bench.py frames` or `./bench.py scale`"""
+
+import argparse
+import os
+import tempfile
+import timeit
+import tracemalloc
+import warnings
+from time import perf_counter
+
+import colour
+import fx
+from compositor import ArrayCompositor, ImageCompositor, np
+from show import ShowWriter
+from stats import Timings
+
+# Colour arguments typical of the /bg, /fade and /flash messages sent by Sonic Pi
+TRIGGERS = [('red', 'blue'),
+            ('#f80', [0.3, 'yellow'], 'white'),
+            ('transparent', 'green'),
+            ('black', [0.5, '#00f8'], [0.7, 'red', 'orange'], 'white')]
+
+
+def bench_scale(number):
+    """Cost per trigger of building and compiling the colour scale for its arguments"""
+    def build():
+        for args in TRIGGERS:
+            colour.scale(*args).compile()
+
+    cached = colour.getrgba
+    try:
+        # Bypass both caches, to get the cost of building every scale from scratch
+        colour.getrgba = cached.__wrapped__
+        uncached = timeit.timeit(lambda: [colour._scale(*args).compile() for args in TRIGGERS],
+                                 number=number)
+    finally:
+        colour.getrgba = cached
+    build()
+    memoized = timeit.timeit(build, number=number)
+    per_trigger = 1e6 / (number * len(TRIGGERS))
+    print("colour.scale per trigger: uncached {:.1f}us, cached {:.1f}us".format(
+        uncached * per_trigger, memoized * per_trigger))
+
+
+# A scene with a static background and a mix of animated effects on top
+SCENE = [('/bg', 'red', 'blue'),
+         ('/spin', 2, 'green', '#00f8', 100, 'yellow'),
+         ('/chase', 1, 0.05, -1, 8, 2, 'white'),
+         ('/sparkle', 100, 0.5, 5, 'red', 'white'),
+         ('/flame', 2, 1, '012')]
+
+
+# Pre-rendered frames played by the script, written for each canvas size
+SHOW = os.path.join(tempfile.gettempdir(), 'sonic-pixels-bench.show')
+
+# Commands sent at each time (in seconds) through a cycle, covering every effect
+SCRIPT = [(0.0, ('/clear',)),
+          (0.0, ('/bg', 'red', 'blue')),
+          (0.0, ('/fade', 'green', 1, 'black', 1, '#f808')),
+          (0.1, ('/play', SHOW, 0.5)),
+          (0.2, ('/spin', 0.5, 'red', '#00f8', 2, 'yellow')),
+          (0.5, ('/rotate', 0.7, 4)),
+          (0.8, ('/chase', 0.5, 0.05, 4, 6, 2, 'white')),
+          (1.0, ('/slide', 0.4, 'cyan', 'red')),
+          (1.5, ('/flash', 0.3, 'white')),
+          (1.6, ('/sparkle', 1, 0.2, 5, 'red', 'white')),
+          (2.0, ('/flame', 2, 1, '012')),
+          (2.5, ('/flash', 0.2, 'yellow')),
+          (2.5, ('/slide', -0.5, 'magenta')),
+          (3.0, ('/sparkle', 0.5, 0.5, 20, 'exp', 'white')),
+          (3.5, ('/blend', 90, 'add', 0.7))]
+CYCLE = 4.0
+SIZES = [(60, 1), (300, 1), (32, 32)]
+
+
+def controller(width, height, compositor=None, leds=None):
+    """Create a Controller that renders without an event loop, or LEDs unless given"""
+    from controller import Controller
+    with warnings.catch_warnings():
+        # There is no running event loop, but the controller is never started
+        warnings.simplefilter('ignore', DeprecationWarning)
+        c = Controller(width, height, 0.05, leds, False)
+    if compositor is not None:
+        c.compositor = compositor(c.size)
+    return c
+
+
+def bench_alloc(number):
+    """Memory allocated while compositing each frame, measured with tracemalloc.
+    Pillow allocates image memory natively, where tracemalloc can't see it,
+    so the number of images it creates is counted separately."""
+    from PIL import Image
+    kinds = [ImageCompositor] + ([ArrayCompositor] if np is not None else [])
+    for kind in kinds:
+        fx.seed(0)
+        c = controller(60, 16, kind)
+        for msg in SCENE:
+            c.handler(*msg)
+        for i in range(10):
+            c.render(i * 0.05)
+        tracemalloc.start()
+        images = Image.core.get_stats()['new_count']
+        peak = 0
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(10, 10 + number):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            c.render(i * 0.05)
+            peak += tracemalloc.get_traced_memory()[1] - before
+        growth = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        images = Image.core.get_stats()['new_count'] - images
+        print("{}: {:.0f} bytes allocated at peak, {:.1f} bytes retained and {:.1f} images "
+              "created per frame".format(kind.__name__, peak / number, growth / number,
+                                         images / number))
+
+
+def script_commands():
+    """Yield the (time, command) pairs of the script, repeating it every cycle"""
+    cycle = 0
+    while True:
+        for time, cmd in SCRIPT:
+            yield time + cycle * CYCLE, cmd
+        cycle += 1
+
+
+def play_script(width, height, frames, period=0.05):
+    """Replay the script on a simulated clock into a null LED strip, returning the wall
+    clock time taken for each frame, including colour conversion and output"""
+    from led import LEDStrip
+    fx.seed(0)
+    leds = LEDStrip('null', width * height, 800000, 18, 5, 0, 'grb', False, 255, None, False)
+    c = controller(width, height, leds=leds)
+    missing = set(c.fx) - set(cmd[0] for _, cmd in SCRIPT)
+    if missing:
+        print("Not covered by the script:", ', '.join(sorted(missing)))
+    times = Timings(frames)
+    script = script_commands()
+    due, cmd = next(script)
+    for frame in range(frames):
+        now = frame * period
+        start = perf_counter()
+        # Send the commands due since the last frame, as they would arrive between frames
+        while due <= now:
+            c.handler(*cmd)
+            due, cmd = next(script)
+        c.update(now)
+        times.add(perf_counter() - start)
+    return times
+
+
+def write_show(width, height, frames=40):
+    c = controller(width, height)
+    c.handler('/spin', 1, 'red', 'green', 'blue')
+    writer = ShowWriter(SHOW, (width, height), 0.05)
+    for i in range(frames):
+        writer.add(c.render(i * 0.05))
+    writer.close()
+
+
+def bench_frames(number):
+    """Frame rate and latency of the whole pipeline playing a script of every effect,
+    at several canvas sizes, and the peak memory allocated by Python while doing so"""
+    from PIL import Image
+    for width, height in SIZES:
+        write_show(width, height)
+        times = play_script(width, height, number)
+        tracemalloc.start()
+        images = Image.core.get_stats()['new_count']
+        play_script(width, height, number)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        images = Image.core.get_stats()['new_count'] - images
+        print("{}x{}: {:.0f} fps, latency {}, peak {:.1f}kB allocated, "
+              "{:.1f} images created per frame".format(
+                  width, height, times.count / times.total, times.summary(50, 90, 99),
+                  peak / 1024, images / number))
+
+
+BENCHMARKS = {'alloc': bench_alloc,
+              'frames': bench_frames,
+              'scale': bench_scale}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs='*',
+                        help="Benchmarks to run, from: {} (default all)".format(
+                            ', '.join(sorted(BENCHMARKS))))
+    parser.add_argument("--number", type=int, default=1000,
+                        help="Number of repetitions")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: " + name)
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name](args.number)
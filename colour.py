@@ -1,7 +1,18 @@
 from bisect import bisect
-from PIL import ImageColor
+from functools import lru_cache
+from PIL import Image, ImageColor
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
+def freeze(c):
+    """Convert (nested) lists of colour points to tuples, so they can be used as cache keys"""
+    return tuple(freeze(v) for v in c) if isinstance(c, (list, tuple)) else c
+
+
+@lru_cache(maxsize=256)
 def getrgba(s):
     """Get an RGBA colour tuple from a string"""
     if s.lower() == 'transparent':  # add a name for fully transparent
@@ -29,13 +40,64 @@ def _interpolate(vals, x):
     return int(vals[i - 1][2] + d1 * (x - vals[i - 1][0]) / d0)
 
 
+def _interpolate_array(vals, xs):
+    # Same as _interpolate, for a whole array of positions at once
+    pos = np.array([v[0] for v in vals], dtype=float)
+    left = np.array([v[1] for v in vals], dtype=float)
+    right = np.array([v[2] for v in vals], dtype=float)
+    i = np.clip(np.searchsorted(pos, xs), 1, len(vals) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = np.trunc(right[i - 1] + (left[i] - right[i - 1]) * (xs - pos[i - 1])
+                       / (pos[i] - pos[i - 1]))
+    res = np.where(xs == pos[i], right[i], res)
+    res = np.where(xs < pos[0], left[0], res)
+    return np.where(xs >= pos[-1], right[-1], res)
+
+
 class ColourScale:
+    RESOLUTION = 1024  # Number of entries in the lookup table used by map()
+
     def __init__(self, cols):
         self.cols = cols
+        self._lut = None
 
     def __call__(self, x):
         return tuple(_interpolate(col, x) for col in self.cols)
 
+    def compile(self):
+        """Build the lookup table of colours at evenly spaced positions from 0 to 1"""
+        if self._lut is None:
+            n = self.RESOLUTION
+            if np is not None:
+                xs = np.linspace(0, 1, n)
+                self._lut = np.stack([_interpolate_array(col, xs) for col in self.cols],
+                                     axis=-1).astype(np.uint8)
+            else:
+                self._lut = [self(i / (n - 1.0)) for i in range(n)]
+        return self
+
+    def map(self, values):
+        """Look up the colours at many positions (clamped to 0-1) at once.
+        With NumPy this returns an array of RGBA values with one more axis than `values`,
+        otherwise a list of RGBA tuples."""
+        self.compile()
+        n = self.RESOLUTION - 1
+        if np is not None:
+            idx = np.rint(np.asarray(values, dtype=float) * n).astype(np.intp)
+            return self._lut[np.clip(idx, 0, n, out=idx)]
+        return [self._lut[min(n, max(0, int(round(v * n))))] for v in values]
+
+    def image(self, size):
+        """Draw the scale as a horizontal gradient filling an image of the given size"""
+        w, h = size
+        if np is not None:
+            xs = np.linspace(0, 1, w) if w > 1 else np.full(w, 0.5)
+            row = self.map(xs)
+            return Image.frombytes('RGBA', size, np.broadcast_to(row, (h, w, 4)).tobytes())
+        strip = Image.new('RGBA', (w, 1))
+        strip.putdata(self.map([x / (w - 1.0) for x in range(w)] if w > 1 else [0.5] * w))
+        return strip.resize(size, Image.NEAREST)
+
     def is_flat(self):
         for c in self.cols:
             v = c[0][1]
@@ -47,14 +109,19 @@ class ColourScale:
 
 def scale(*args):
     """Get a colour scale, either by name or by building a scale from a list of points
-    The magma, plasma, inferno & viridis scales are approximations of their matplotlib namesakes"""
+    The magma, plasma, inferno & viridis scales are approximations of their matplotlib namesakes.
+    Scales are cached and shared, so must not be modified."""
+    args = freeze(args)
     if len(args) == 1:
         if isinstance(args[0], ColourScale):
             return args[0]
-        try:
+        if args[0] in scales:
             return scales[args[0]]
-        except KeyError:
-            pass
+    return _cached_scale(args)
+
+
+@lru_cache(maxsize=256)
+def _cached_scale(args):
     return _scale(*args)
 
 
@@ -109,17 +176,7 @@ def _scale(*args):
 
 def show(*args):
     """Show a colour scale on screen"""
-    from PIL import Image
-    w = 1000
-    h = 100
-    sc = scale(*args)
-    img = Image.new('RGBA', (w, h))
-    pix = img.load()
-    for x in range(w):
-        c = sc(x/w)
-        for y in range(h):
-            pix[x, y] = c
-    img.show()
+    scale(*args).image((1000, 100)).show()
 
 
 scales = dict(flame=_scale('transparent', [0.4, 'red'], [0.7, 'yellow'], 'white'),
@@ -199,3 +256,5 @@ scales = dict(flame=_scale('transparent', [0.4, 'red'], [0.7, 'yellow'], 'white'
                                     [1, 36, 36]],
                                    [[0, 255, 255],
                                     [1, 255, 255]]]))
+for sc in scales.values():
+    sc.compile()
@@ -0,0 +1,155 @@
+from PIL import Image, ImageChops
+from fx import Sprite
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# How a layer's colours are combined with the layers below, before mixing in by its alpha
+BLEND_MODES = ('normal', 'add', 'screen', 'multiply', 'max')
+
+
+def footprint(sprite, size):
+    """Clip a Sprite to a frame of the given size, returning the (x0, y0, x1, y1) box
+    it covers in the frame, or None if it is entirely outside"""
+    w, h = size
+    sw, sh = (sprite.image.size if isinstance(sprite.image, Image.Image)
+              else sprite.image.shape[1::-1])
+    x0, y0 = max(sprite.x, 0), max(sprite.y, 0)
+    x1, y1 = min(sprite.x + sw, w), min(sprite.y + sh, h)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+class ImageCompositor:
+    """Stacks layers with Pillow operations, allocating new images for every layer"""
+    CHOPS = {'screen': ImageChops.screen,
+             'multiply': ImageChops.multiply,
+             'max': ImageChops.lighter}
+
+    def __init__(self, size):
+        self.base = Image.new('RGBA', size, (0, 0, 0, 255))
+        self.static = self.base
+        self.frame = self.base
+        self.scratch = None
+
+    def begin(self, cached):
+        """Start a frame, either from black or from the saved composite of the static layers"""
+        self.frame = self.static if cached else self.base
+
+    def blend(self, img, mode='normal', opacity=1):
+        if isinstance(img, Sprite):
+            box = footprint(img, self.frame.size)
+            if box is None:
+                return
+            x0, y0, x1, y1 = box
+            src = img.image.crop((x0 - img.x, y0 - img.y, x1 - img.x, y1 - img.y))
+            region = self._blend(self.frame.crop(box), src, mode, opacity)
+            # The frame may be shared with the saved static composite, so don't paste into it
+            self.frame = self.frame.copy()
+            self.frame.paste(region, box[:2])
+            return
+        self.frame = self._blend(self.frame, img, mode, opacity)
+
+    def _blend(self, frame, img, mode, opacity):
+        if opacity < 1:
+            img = img.copy()
+            img.putalpha(img.split()[3].point(lambda v: int(v * opacity + 0.5)))
+        if mode == 'normal':
+            return Image.alpha_composite(frame, img)
+        dst = frame.convert('RGB')
+        src = img.convert('RGB')
+        alpha = img.split()[3]
+        if mode == 'add':
+            res = ImageChops.add(dst, ImageChops.multiply(src, Image.merge('RGB', (alpha,) * 3)))
+        else:
+            res = Image.composite(self.CHOPS[mode](dst, src), dst, alpha)
+        return res.convert('RGBA')
+
+    def save_static(self):
+        """Save the frame so far as the composite of the static layers"""
+        self.static = self.frame
+
+
+class ArrayCompositor:
+    """Stacks layers in place in a preallocated frame buffer, so that compositing doesn't allocate.
+    Layers can render straight into the scratch buffer, which is reused for each one."""
+    def __init__(self, size):
+        w, h = size
+        self.frame = np.zeros((h, w, 4), np.uint8)
+        self.frame[..., 3] = 255
+        self.base = self.frame.copy()
+        self.static = self.frame.copy()
+        self.scratch = np.zeros((h, w, 4), np.uint8)
+        # Working buffers, all the same shape and type so that numpy needs no temporary ones
+        self.alpha = np.zeros((h, w, 3), np.uint16)
+        self.src = np.zeros((h, w, 3), np.uint16)
+        self.dst = np.zeros((h, w, 3), np.uint16)
+        self.tmp = np.zeros((h, w, 3), np.uint16)
+
+    def begin(self, cached):
+        """Start a frame, either from black or from the saved composite of the static layers"""
+        np.copyto(self.frame, self.static if cached else self.base)
+
+    def blend(self, img, mode='normal', opacity=1):
+        # The frame is always opaque, so the result is the blended colour mixed with
+        # the frame by the layer's alpha: res * a + dst * (1 - a), in 8 bit fixed point
+        if isinstance(img, Sprite):
+            # Only blend the part of the frame the sprite covers
+            box = footprint(img, self.frame.shape[1::-1])
+            if box is None:
+                return
+            x0, y0, x1, y1 = box
+            src = np.asarray(img.image)[y0 - img.y:y1 - img.y, x0 - img.x:x1 - img.x]
+            rgb = self.frame[y0:y1, x0:x1, :3]
+            a, s, d, tmp = (buf[:y1 - y0, :x1 - x0]
+                            for buf in (self.alpha, self.src, self.dst, self.tmp))
+        else:
+            src = np.asarray(img)
+            rgb = self.frame[..., :3]
+            a, s, d, tmp = self.alpha, self.src, self.dst, self.tmp
+        np.copyto(a, src[..., 3:])
+        np.copyto(s, src[..., :3])
+        np.copyto(d, rgb)
+        if opacity < 1:
+            a *= int(opacity * 255 + 0.5)
+            a += 127
+            a //= 255
+        if mode == 'add':
+            # Adding the colour scaled by alpha can't be expressed as a mix, so is done directly
+            s *= a
+            s += 127
+            s //= 255
+            d += s
+            np.minimum(d, 255, out=d)
+        else:
+            if mode == 'screen':
+                np.subtract(255, d, out=tmp)
+                np.subtract(255, s, out=s)
+                s *= tmp
+                s += 127
+                s //= 255
+                np.subtract(255, s, out=s)
+            elif mode == 'multiply':
+                s *= d
+                s += 127
+                s //= 255
+            elif mode == 'max':
+                np.maximum(s, d, out=s)
+            s *= a
+            np.subtract(255, a, out=a)
+            d *= a
+            d += s
+            d += 127
+            d //= 255
+        np.copyto(rgb, d, casting='unsafe')
+
+    def save_static(self):
+        """Save the frame so far as the composite of the static layers"""
+        np.copyto(self.static, self.frame)
+
+
+def make_compositor(size):
+    return ArrayCompositor(size) if np is not None else ImageCompositor(size)
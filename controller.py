@@ -1,38 +1,131 @@
 from asyncio import get_event_loop
-from fx import FXBase
-from PIL import Image
+from heapq import heappop, heappush
+from compositor import BLEND_MODES, make_compositor
+from fx import FXBase, gradient_cache_info
+from parallel import ParallelRenderer
+from stats import Timings
+from time import perf_counter, time as wall_time
 
 import re
 
 
 class Controller:
     FX_SUFFIX = re.compile('fx$')
+    STATS_INTERVAL = 5  # Seconds between frame statistics reports in debug mode
+    # Furthest ahead in seconds a bundle can be scheduled (Sonic Pi sends them 0.5s ahead).
+    # Timetags further ahead probably mean this clock is behind the sender's.
+    MAX_LEAD = 5
 
-    def __init__(self, width, height, period, leds, debug):
+    def __init__(self, width, height, period, leds, debug, adaptive=False, workers=0,
+                 canvas=None, origin=(0, 0), profile=None):
         self.period = period
+        self.frame_period = period  # May be raised above period when adaptive
+        self.adaptive = adaptive
         self.leds = leds
         self.size = (width, height)
+        # When only rendering part of a larger canvas: its full size, and where this part starts
+        self.canvas = canvas or self.size
+        self.origin = origin
         self.debug = debug
+        self.profile = profile  # A stats.Profile to time each stage of rendering, if enabled
         self.layers = {}
+        self.blend_modes = {}  # Blend mode and opacity for each layer, if not normal
+        self.blend_version = 0  # Changed with the blend modes, so cached backgrounds are redrawn
+        self.retired = 0  # Number of finished effects removed from the layers
+        self.render_times = Timings()
+        self.render_avg = 0.0
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
         self.loop = get_event_loop()
-        self.handle = self.loop.call_soon(self._loop, self.loop)
-        self.last = None
+        self.next_frame = self.loop.time()
+        self.last_report = self.next_frame
+        self.handle = None
+        self.extra = None  # Handle of a pending out of schedule frame
+        self.extra_done = False  # Whether an extra frame has been rendered since the last tick
+        self.scheduled = []  # Heap of (time, number, messages) for bundles not yet due
+        self.bundles = 0
+        self.activation = None  # Handle of the call to apply the next scheduled bundle
+        self.last = None  # Static layers making up the frame on the LEDs, if it was fully static
+        self.compositor = make_compositor(self.size)
+        # Layers at the bottom of the stack whose output no longer changes
+        # (the compositor keeps their composite)
+        self.static_layers = ()
+        self.fully_static = False
         self.fx = {self._fx_addr(fx): fx
                    for fx in FXBase.__subclasses__()}
+        self.renderer = None
+        if workers > 1 and height < 2:
+            # The workers each render a band of rows, so there is nothing to split
+            print("Rendering in one process, as workers need at least 2 rows to share")
+        elif workers > 1:
+            self.renderer = ParallelRenderer(self.size, workers)
+
+    def start(self):
+        """Start rendering frames on the event loop"""
+        self.next_frame = self.loop.time()
+        self.handle = self.loop.call_soon(self._tick)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+        if self.activation is not None:
+            self.activation.cancel()
+        if self.renderer is not None:
+            self.renderer.close()
 
     def _fx_addr(self, fx):
         # FX name in lower case with 'fx' suffix removed, and '/' in front
         return '/' + re.sub(Controller.FX_SUFFIX, '', fx.__name__.lower(), 1)
 
     def handler(self, addr, *args):
+        self.apply(addr, args)
+        self._request_frame()
+
+    def bundle(self, timetag, messages):
+        """Apply the (address, args) messages of an OSC bundle together at the time of its timetag,
+        in seconds since the epoch. Effects they start begin exactly then, between frames."""
+        now = self.loop.time()
+        lead = timetag - wall_time()
+        if lead > self.MAX_LEAD:
+            if self.debug:
+                print("Bundle is {:.1f}s ahead, applying it now (is the clock set?)".format(lead))
+            lead = 0
+        when = now + lead
+        if when > now:
+            heappush(self.scheduled, (when, self.bundles, messages))
+            self.bundles += 1
+            self._schedule_activation()
+            return
+        # Start effects from bundles that have only just arrived late at their time
+        start = when if now - when < self.frame_period else None
+        for addr, args in messages:
+            self.apply(addr, args, start)
+        self._request_frame()
+
+    def apply(self, addr, args, start_time=None):
+        """Act on a message. Effects it starts begin at start_time if given, or else on the next
+        frame"""
         if self.debug:
             print(addr, args)
-        if addr == '/bright':
+        if addr in ('/bright', '/gamma', '/whitebalance') and self.leds is None:
+            # Colour correction is applied by the LEDs, so there is nothing to do without them
+            # (e.g. when rendering offline, where frames are stored uncorrected)
+            pass
+        elif addr == '/bright':
             self.last = None
             self.leds.brightness(*args)
         elif addr == '/gamma':
             self.last = None
             self.leds.gamma(*args)
+        elif addr == '/whitebalance':
+            self.last = None
+            self.leds.white_balance(*args)
+        elif self.renderer is not None and (addr in ('/clear', '/kill', '/blend')
+                                            or addr in self.fx):
+            self.renderer.message(addr, args, start_time)
+        elif addr == '/blend':
+            self.set_blend(*args)
         elif addr in ('/clear', '/kill'):
             self.layers = {}
         elif addr == '/mod':
@@ -40,30 +133,194 @@ class Controller:
             self.layers[100] = [FadeFX(self.size, *args), prev]
         elif addr in self.fx:
             fxclass = self.fx[addr]
-            fx = fxclass(self.size, args)
-            layer = fx.default_layer()
+            fx = fxclass(self.size, args, canvas=self.canvas, origin=self.origin)
+            fx.start_time = start_time
+            layer = fxclass.default_layer()
             if layer in self.layers:
                 fx.image = self.layers[layer].image
             self.layers[layer] = fx
         else:
             print("Unrecognised CMD:", addr, args)
-        self.handle.cancel()
-        self.handle = self.loop.call_soon(self._loop, self.loop)
 
-    def update(self, time):
-        img = Image.new('RGBA', self.size, (0, 0, 0, 255))
-        for n in sorted(self.layers.keys()):
-            layer = self.layers[n]
-            nextimg = layer.next_image(time, img)
+    def _schedule_activation(self):
+        if self.activation is not None:
+            self.activation.cancel()
+        self.activation = None
+        if self.scheduled:
+            self.activation = self.loop.call_at(self.scheduled[0][0], self._activate)
+
+    def _activate(self):
+        # Apply all the bundles that are due, and show them together
+        if self._apply_scheduled(self.loop.time()):
+            self._request_frame()
+        self._schedule_activation()
+
+    def _apply_scheduled(self, time):
+        applied = False
+        while self.scheduled and self.scheduled[0][0] <= time:
+            when, _, messages = heappop(self.scheduled)
+            for addr, args in messages:
+                self.apply(addr, args, when)
+            applied = True
+        return applied
+
+    def set_blend(self, layer, mode='normal', opacity=1):
+        """Set how a layer is blended, by its number or the name of the effect that uses it"""
+        if isinstance(layer, str):
+            fxclass = self.fx.get(layer if layer.startswith('/') else '/' + layer)
+            if fxclass is None:
+                print("Unrecognised layer:", layer)
+                return
+            layer = fxclass.default_layer()
+        if mode not in BLEND_MODES:
+            print("Unrecognised blend mode:", mode)
+            return
+        if not 0 <= opacity <= 1:
+            print("Opacity out of range 0-1:", opacity)
+            return
+        if mode == 'normal' and opacity >= 1:
+            self.blend_modes.pop(layer, None)
+        else:
+            self.blend_modes[layer] = (mode, opacity)
+        # The cached static layers may have been blended differently
+        self.blend_version += 1
+        self.static_layers = ()
+        self.last = None
+
+    def render(self, time):
+        """Render all the layers at the given time, returning the composited image"""
+        if self.renderer is not None:
+            return self.renderer.render(time)
+        keys = sorted(self.layers.keys())
+        layers = tuple(self.layers[n] for n in keys)
+        # Reuse the composite of the static layers at the bottom of the stack, if still present
+        n = len(self.static_layers)
+        if layers[:n] != self.static_layers:
+            n = 0
+            self.static_layers = ()
+        comp = self.compositor
+        comp.begin(n > 0)
+        profile = self.profile
+        blending = 0.0
+        static = True
+        for i in range(n, len(layers)):
+            key, layer = keys[i], layers[i]
+            # While only static layers are below, the background changes only with those layers
+            bg_key = (self.blend_version,) + layers[:i] if static else None
+            if profile is not None:
+                start = perf_counter()
+            nextimg = layer.next_image(time, comp.frame, comp.scratch, bg_key)
+            if profile is not None:
+                rendered = perf_counter()
+                profile.add('{}:{}'.format(type(layer).__name__, key), rendered - start)
             if nextimg is not None:
-                img = Image.alpha_composite(img, nextimg)
-        if img != self.last:
+                comp.blend(nextimg, *self.blend_modes.get(key, ()))
+            if profile is not None:
+                blending += perf_counter() - rendered
+            if layer.is_finished(time):
+                self._retire(key)
+            elif static and layer.is_static(time):
+                self.static_layers += (layer,)
+                comp.save_static()
+            else:
+                static = False
+        self.fully_static = static
+        if profile is not None:
+            profile.add('composite', blending)
+        return comp.frame
+
+    def update(self, time):
+        if self.profile is not None and self.renderer is not None:
+            start = perf_counter()
+            img = self.render(time)
+            self.profile.add('render', perf_counter() - start)
+        else:
+            img = self.render(time)
+        shown = self.static_layers if self.fully_static and self.renderer is None else None
+        if shown is None or shown != self.last:
+            # The strip only rewrites the pixels that have actually changed
             self.leds.image(img)
-        self.last = img
-
-    def _loop(self, loop, time=None):
-        if time is None:
-            time = loop.time()
-        self.update(loop.time())
-        self.handle = loop.call_at(time + self.period, self._loop,
-                                   loop, time + self.period)
+        self.last = shown
+
+    def _retire(self, key):
+        layer = self.layers.pop(key)
+        self.retired += 1
+        if self.debug:
+            print("Retired", type(layer).__name__, "from layer", key,
+                  "- active:", len(self.layers), "retired:", self.retired)
+
+    def _request_frame(self):
+        # Show changes straight away, but render at most one extra frame between regular ticks,
+        # so that a burst of messages doesn't trigger a burst of renders
+        if self.handle is not None and self.extra is None and not self.extra_done:
+            self.extra = self.loop.call_soon(self._extra_frame)
+
+    def _extra_frame(self):
+        self.extra = None
+        self.extra_done = True
+        self._render(self.loop.time())
+
+    def _render(self, time):
+        self.update(time)
+        elapsed = self.loop.time() - time
+        self.render_times.add(elapsed)
+        self.render_avg += (elapsed - self.render_avg) * 0.1
+        self.frames += 1
+        return elapsed
+
+    def _tick(self):
+        now = self.loop.time()
+        if now - self.next_frame > self.frame_period / 2:
+            self.late += 1
+        if self._apply_scheduled(now):
+            self._schedule_activation()
+        self._render(now)
+        self.extra_done = False
+        if self.adaptive:
+            self._adapt()
+        # Keep to the original schedule, skipping any frames we have already missed
+        end = self.loop.time()
+        missed = int((end - self.next_frame) // self.frame_period)
+        if missed > 0:
+            self.dropped += missed
+        self.next_frame += (max(missed, 0) + 1) * self.frame_period
+        self.handle = self.loop.call_at(self.next_frame, self._tick)
+        if self.profile is not None:
+            self.profile.tick(end)
+        if self.debug and end - self.last_report >= self.STATS_INTERVAL:
+            self.last_report = end
+            self.report()
+
+    def _adapt(self):
+        # Back off the frame rate while rendering takes most of the frame period,
+        # and recover it gradually once rendering is comfortably fast again
+        if self.render_avg > 0.8 * self.frame_period:
+            self.frame_period = min(self.frame_period * 1.25, self.period * 4)
+        elif self.render_avg < 0.4 * self.frame_period and self.frame_period > self.period:
+            self.frame_period = max(self.frame_period / 1.25, self.period)
+
+    def stats(self, *args):
+        """Reply to a /stats query: a message with the frame counts, then one per timed stage
+        with its name, count, mean, and p50, p90, p99 and maximum durations in ms"""
+        stages = dict(frame=self.render_times.histogram())
+        if self.profile is not None:
+            stages.update(self.profile.histograms())
+        return ([('/stats/frames', [self.frames, self.late, self.dropped, self.total_retired()])] +
+                [('/stats/stage', [name, h['count'], h['mean'], h['p50'], h['p90'], h['p99'],
+                                   h['p100']])
+                 for name, h in stages.items()])
+
+    def total_retired(self):
+        """Number of finished effects removed, by this controller or its workers"""
+        return self.retired if self.renderer is None else self.renderer.retired
+
+    def report(self):
+        print("Frames:", self.frames, "late:", self.late, "dropped:", self.dropped,
+              "render", self.render_times.summary(50, 99),
+              "period: {:.1f}ms".format(self.frame_period * 1000),
+              "layers active:",
+              len(self.layers) if self.renderer is None else self.renderer.layers,
+              "retired:", self.total_retired())
+        cache = gradient_cache_info()
+        print("Gradient cache hits:", cache.hits, "misses:", cache.misses,
+              "size:", cache.currsize)
@@ -1,4 +1,6 @@
 import sys
+import threading
+from time import monotonic
 
 
 def Color(red, green, blue, white=0):
@@ -16,19 +18,45 @@ class ws:
 
 
 class Fake_NeoPixel:
+    """Shows the LEDs in the terminal, either as a line of dots or, given the number of LEDs
+    per row, as a matrix using half blocks to fit two rows of LEDs in each line of text.
+    Given the sizes of several outputs, each is shown on its own line through its segment.
+    After the first frame, only the LEDs that have changed are redrawn, unless in debug mode
+    where every frame is printed on a new line."""
+    GREY = '\x1b[48;2;64;64;64m'  # Background around the LEDs
+    HALF_BLOCK = '\u2580'  # Upper half block, coloured by the upper LED over the lower one
+    CACHE_SIZE = 4096  # Colours to keep escape sequences for
+
     def __init__(self, num, pin, freq_hz=800000, dma=5, invert=False,
-                 brightness=255, channel=None, strip_type=None, debug=False):
+                 brightness=255, channel=None, strip_type=None, debug=False,
+                 width=None, max_fps=0, segments=None):
         self.dest = sys.stdout
         self._ledstr = '●'  # small
         # self._ledstr = '⬤ '  # big
         self._led_data = [0]*num
         self._brightness = brightness
         self.debug = debug
+        self.width = width if width and width < num else None
+        self.segments = []
+        start = 0
+        for n in segments or []:
+            self.segments.append(FakeSegment(self, start, n))
+            start += n
+        # Frames shown sooner than this after the last one are deferred, and only the latest drawn
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self._fg = {}  # Escape sequences for each colour
+        self._bg = {}
+        self._shown = None  # Cells in the terminal, if they can be updated in place
+        self._painted = 0
+        self._timer = None
+        self._lock = threading.Lock()
 
     def __del__(self):
         self._cleanup()
 
     def _cleanup(self):
+        if self._timer is not None:
+            self._timer.cancel()
         # Ensure default colour, and show cursor again
         print('\x1b[39;49m\x1b[?25h', file=self.dest, flush=True)
 
@@ -36,27 +64,109 @@ class Fake_NeoPixel:
         pass
 
     def show(self):
-        b = self._brightness / 255.0
-
-        def col(bits, shift):
-            w = ((bits >> 24) & 0xff)
-            c = ((bits >> shift) & 0xff)
-            return min(255, round((c + w) * b))
-
-        print('\x1b[?25l',  # Hide cursor
-              '' if self.debug else '\x0d',  # Go back to start of line
-              '\x1b[48;2;64;64;64m',  # Set grey background
-              ' ',
-              ''.join('\x1b[38;2;{r};{g};{b}m{s}'.format(r=col(c, 16),
-                                                         g=col(c, 8),
-                                                         b=col(c, 0),
-                                                         s=self._ledstr)
-                      for c in self._led_data),  # Coloured pixels
-              ' ',
-              '\x1b[39;49m',  # Reset colour to default
-              '  ',           # Overwrite any following chars if present
-              '\n' if self.debug else '',
-              sep='', end='', file=self.dest, flush=True)
+        with self._lock:
+            now = monotonic()
+            wait = self._painted + self.min_interval - now
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self._deferred)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._paint(now)
+
+    def _deferred(self):
+        with self._lock:
+            self._timer = None
+            self._paint(monotonic())
+
+    def _lines(self):
+        """The cells to display on each line: an LED colour, or (upper, lower) for a matrix"""
+        data = list(self._led_data)
+        if self.segments:
+            return [data[seg.start:seg.start + seg.num] for seg in self.segments]
+        if self.width is None:
+            return [data]
+        w = self.width
+        rows = [data[i:i + w] for i in range(0, len(data), w)]
+        lines = []
+        for i in range(0, len(rows), 2):
+            lower = rows[i + 1] if i + 1 < len(rows) else []
+            lines.append([(u, lower[j] if j < len(lower) else None)
+                          for j, u in enumerate(rows[i])])
+        return lines
+
+    def _escape(self, cache, code, c):
+        esc = cache.get(c)
+        if esc is None:
+            if len(cache) >= self.CACHE_SIZE:
+                cache.clear()
+            b = self._brightness / 255.0
+            w = (c >> 24) & 0xff
+            esc = cache[c] = '\x1b[{};2;{};{};{}m'.format(
+                code, *(min(255, round((((c >> shift) & 0xff) + w) * b)) for shift in (16, 8, 0)))
+        return esc
+
+    def _cell(self, cell):
+        if self.width is None:
+            return self._escape(self._fg, 38, cell) + self._ledstr
+        upper, lower = cell
+        return (self._escape(self._fg, 38, upper) +
+                (self.GREY if lower is None else self._escape(self._bg, 48, lower)) +
+                self.HALF_BLOCK)
+
+    def _paint(self, now):
+        self._painted = now
+        lines = self._lines()
+        shown = self._shown
+        if self.debug or shown is None or len(shown) != len(lines):
+            out = self._paint_all(lines)
+        else:
+            out = self._paint_changes(lines, shown)
+        self._shown = None if self.debug else lines
+        print(*out, sep='', end='', file=self.dest, flush=True)
+
+    def _paint_all(self, lines):
+        out = ['\x1b[?25l']  # Hide cursor
+        if not self.debug:
+            # Go back to the start of the display
+            if self._shown is not None and len(self._shown) > 1:
+                out.append('\x1b[{}A'.format(len(self._shown) - 1))
+            out.append('\x0d')
+        for n, line in enumerate(lines):
+            if n > 0:
+                out.append('\n')
+            out += [self.GREY, ' ']
+            out += [self._cell(c) for c in line]
+            out += [self.GREY, ' ',
+                    '\x1b[39;49m',  # Reset colour to default
+                    '  ']  # Overwrite any following chars if present
+        if self.debug:
+            out.append('\n')
+        return out
+
+    def _paint_changes(self, lines, shown):
+        # The cursor is left on the last line, and each changed cell is moved to
+        # unless it directly follows the previous one
+        out = [self.GREY]
+        last = len(lines) - 1
+        row, col = last, None
+        for n, (line, old) in enumerate(zip(lines, shown)):
+            for i, (c, o) in enumerate(zip(line, old)):
+                if c == o:
+                    continue
+                if row != n:
+                    out.append('\x1b[{}{}'.format(abs(row - n), 'A' if row > n else 'B'))
+                    row = n
+                if col != i:
+                    out.append('\x1b[{}G'.format(i + 2))
+                out.append(self._cell(c))
+                col = i + 1
+            col = None
+        if row != last:
+            out.append('\x1b[{}B'.format(last - row))
+        out.append('\x1b[39;49m')
+        return out
 
     def setPixelColor(self, i, c):
         self._led_data[i] = c
@@ -66,6 +176,9 @@ class Fake_NeoPixel:
 
     def setBrightness(self, b):
         self._brightness = b
+        self._fg.clear()
+        self._bg.clear()
+        self._shown = None
 
     def getPixels(self):
         return self._led_data
@@ -75,3 +188,36 @@ class Fake_NeoPixel:
 
     def getPixelColor(self, n):
         return self._led_data[n]
+
+
+class FakeSegment:
+    """One output's LEDs in a Fake_NeoPixel shared by several, with the setPixelColor and
+    numPixels of Adafruit_NeoPixel. They are only drawn when the whole display is shown."""
+    def __init__(self, display, start, num):
+        self.display = display
+        self.start = start
+        self.num = num
+
+    def numPixels(self):
+        return self.num
+
+    def setPixelColor(self, i, c):
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(self.num)
+            i = slice(self.start + start, self.start + stop)
+        else:
+            i += self.start
+        self.display.setPixelColor(i, c)
+
+
+class Null_NeoPixel(Fake_NeoPixel):
+    """Keeps the pixel values but doesn't display them, for benchmarking"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shows = 0
+
+    def _cleanup(self):
+        pass
+
+    def show(self):
+        self.shows += 1
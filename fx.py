@@ -1,20 +1,124 @@
 import colour
-from PIL import Image, ImageChops, ImageColor
+import show
+from PIL import Image, ImageChops
 from abc import ABCMeta, abstractmethod
 from bisect import bisect_right
-from math import exp, sqrt
+from collections import deque, namedtuple
+from functools import lru_cache
+from math import exp, floor, sqrt
 from numbers import Number
-from random import choice, random, randrange
+import os
+from random import Random
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_seed = None  # Seed for the effects' random number generators, if they have been seeded
+_created = 0  # Effects created since seeding
+
+
+def seed(value):
+    """Seed the random number generators used by the effects. Each effect gets its own
+    generators, seeded from this and the number of effects created before it, so the same
+    sequence of commands always renders the same way."""
+    global _seed, _created
+    _seed = value
+    _created = 0
+
+
+def _next_seed():
+    global _created
+    if _seed is None:
+        return None
+    value = (_seed * 1000003 + _created) % 2**32
+    _created += 1
+    return value
+
+
+@lru_cache(maxsize=128)
+def _gradient(colours, size):
+    # The pixels of the image, as immutable bytes that effects can share
+    scale = colour.scale(*colours)
+    if scale.is_flat():
+        return Image.new('RGBA', size, scale(0)).tobytes()
+    return scale.image(size).tobytes()
+
+
+def gradient_cache_info():
+    return _gradient.cache_info()
+
+
+# An image (or array) covering only part of the canvas, with the position of its top left corner.
+# Effects can return one instead of a full image, so only its footprint needs compositing.
+Sprite = namedtuple('Sprite', ['image', 'x', 'y'])
+
+
+class FrameCache:
+    """Frames of a periodic effect keyed by phase, so repeated phases are just looked up.
+    Once the memory limit is reached further frames are rendered each time, rather than
+    evicting frames that will be needed again on the next cycle."""
+    LIMIT = 1 << 20  # Bytes per effect
+
+    def __init__(self):
+        self.frames = {}
+        self.bytes = 0
+        self.source = None
+
+    def get(self, key, render, source=None):
+        if source != self.source:
+            # What the frames were rendered from has changed
+            self.frames = {}
+            self.bytes = 0
+            self.source = source
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = render()
+            size = self.nbytes(frame)
+            if frame is not None and self.bytes + size <= self.LIMIT:
+                # Arrays are rendered into reused buffers, so must be copied to keep them
+                frame = self.detach(frame)
+                self.frames[key] = frame
+                self.bytes += size
+        return frame
+
+    @classmethod
+    def nbytes(cls, frame):
+        if isinstance(frame, Sprite):
+            return cls.nbytes(frame.image)
+        if isinstance(frame, Image.Image):
+            return frame.width * frame.height * len(frame.getbands())
+        return 0 if frame is None else frame.nbytes
+
+    @classmethod
+    def detach(cls, frame):
+        if isinstance(frame, Sprite):
+            return frame._replace(image=cls.detach(frame.image))
+        if isinstance(frame, Image.Image):
+            return frame
+        return frame.copy()
 
 
 class FXBase(object, metaclass=ABCMeta):
-    def __init__(self, size, args):
+    def __init__(self, size, args, canvas=None, origin=(0, 0)):
         self.size = size
+        # Size of the whole canvas and position of this image in it, if only rendering part of it
+        self.canvas = canvas or size
+        self.origin = origin
         self.time = None
         self.start_time = None
         self.previous_time = None
         self.image = None
         self.background = None
+        self.background_key = None
+        # The random number generators are slow to create, so only made for effects that use them
+        self._rng_seed = _next_seed()
+        self._rng = None
+        self._np_rng = None
+        self._arrays = {}
+        self._frames = FrameCache()
+        self._buffers = {}
         self._params = self.params(args) or {}
 
     def __getattr__(self, nm):
@@ -23,43 +127,156 @@ class FXBase(object, metaclass=ABCMeta):
             raise Exception("Can't use params during initialisation")
         return self._params[nm]
 
+    @property
+    def rng(self):
+        if self._rng is None:
+            self._rng = Random(self._rng_seed)
+        return self._rng
+
+    @property
+    def np_rng(self):
+        if self._np_rng is None and np is not None:
+            self._np_rng = np.random.RandomState(self._rng_seed)
+        return self._np_rng
+
     def new_image(self, *colours, size=None, ring=False):
+        """Get an image filled with a horizontal gradient of the colours.
+        The pixels are cached and shared between effects, so the image is read-only: Pillow copies
+        it before drawing on it, but it must be copied before accessing its pixels directly."""
         if size is None:
             size = self.size
         if len(colours) == 0:
             colours = ['transparent']
         if ring and len(colours) > 1:
             colours += (colours[0],)
-        scale = colour.scale(*colours)
-        if scale.is_flat():
-            return Image.new('RGBA', size, scale(0))
-        img = Image.new('RGBA', size)
-        pix = img.load()
-        for x in range(size[0]):
-            i = 0.5 if size[0] < 2 else x / (size[0] - 1.0)
-            c = scale(i)
-            for y in range(size[1]):
-                pix[x, y] = c
-        return img
+        size = tuple(size)
+        return Image.frombuffer('RGBA', size, _gradient(colour.freeze(colours), size),
+                                'raw', 'RGBA', 0, 1)
 
     def params(self, args):
         pass
 
+    @classmethod
     @abstractmethod
-    def default_layer(self):
+    def default_layer(cls):
+        """The layer the effect is drawn on, which is fixed for each class"""
         return 0
 
     @abstractmethod
     def render(self):
         pass
 
-    def next_image(self, time, background):
+    def render_into(self, out):
+        """Render into the preallocated RGBA array `out` (rows, columns, channels) and return it.
+        An effect may instead return another array or image, a Sprite, or None, as from render().
+        Only used when NumPy is available, in which case `self.background` is also an array."""
+        return self.render()
+
+    def array(self, img, dtype=None):
+        """Get the pixels of an image as an RGBA array, converting each image only once"""
+        key = (id(img), dtype)
+        if key not in self._arrays:
+            # Keep a reference to the image, so its id can't be reused
+            self._arrays[key] = (img, np.asarray(img, dtype))
+        return self._arrays[key][1]
+
+    def buffer(self, name, shape, dtype=None):
+        """Get a scratch array that is kept between frames, to avoid allocating one each time"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.zeros(shape, dtype or np.uint8)
+        return buf
+
+    def blend_into(self, out, a, b, alpha):
+        """Interpolate between two float32 arrays like Image.blend, writing the result to `out`"""
+        tmp = self.buffer('blend', out.shape, np.float32)
+        np.subtract(b, a, out=tmp)
+        tmp *= alpha
+        tmp += a
+        tmp += 0.5
+        np.copyto(out, tmp, casting='unsafe')
+        return out
+
+    def offset_into(self, out, src, shift):
+        """Copy an array shifted right with wraparound, like ImageChops.offset"""
+        shift %= src.shape[1]
+        out[:, shift:] = src[:, :src.shape[1] - shift]
+        out[:, :shift] = src[:, src.shape[1] - shift:]
+        return out
+
+    def new_sprite(self, colours, width, fade):
+        """Create a sprite of the given width and the canvas height, filled with a gradient
+        of the colours, whose alpha fades in and out over `fade` pixels at each end"""
+        sprite = self.new_image(*colours, size=(max(width, 0), self.size[1])).copy()
+        if width <= 0:
+            # Nothing to fade, and Pillow can't resize an empty mask
+            return sprite
+        ramp = [255] * width
+        for x in range(min(fade, (width + 1) // 2)):
+            v = int(255 * (x + 1) / (fade + 1) + 0.5)
+            ramp[x] = v
+            if x < width // 2:
+                # Dont double-fade central pixel on odd widths
+                ramp[width - 1 - x] = v
+        mask = Image.new('L', (width, 1))
+        mask.putdata(ramp)
+        mask = mask.resize(sprite.size)
+        sprite.putalpha(ImageChops.multiply(sprite.split()[3], mask))
+        return sprite
+
+    def sprite_into(self, sprite, x, y=0):
+        """Position a sprite image at a fractional column x, returning a Sprite of an array.
+        The sprite is resampled across the two nearest columns with anti-aliased edges,
+        so it moves smoothly rather than jumping a whole pixel at a time."""
+        col = floor(x)
+        frac = x - col
+        if frac == 0:
+            return Sprite(self.array(sprite), col, y)
+        # Interpolate with premultiplied alpha, so colours don't bleed from transparent pixels
+        key = (id(sprite), 'premultiplied')
+        if key not in self._arrays:
+            pm = np.asarray(sprite, np.float32).copy()
+            pm[..., :3] *= pm[..., 3:]
+            self._arrays[key] = (sprite, pm)
+        pm = self._arrays[key][1]
+        h, w = pm.shape[:2]
+        acc = self.buffer('sprite', (h, w + 1, 4), np.float32)
+        tmp = self.buffer('sprite_tmp', (h, w, 4), np.float32)
+        den = self.buffer('sprite_alpha', (h, w + 1, 1), np.float32)
+        out = self.buffer('sprite_out', (h, w + 1, 4))
+        np.multiply(pm, 1 - frac, out=acc[:, :w])
+        acc[:, w] = 0
+        np.multiply(pm, frac, out=tmp)
+        acc[:, 1:] += tmp
+        np.maximum(acc[..., 3:], 1e-3, out=den)
+        acc[..., :3] /= den
+        acc += 0.5
+        np.copyto(out, acc, casting='unsafe')
+        return Sprite(out, col, y)
+
+    def cached(self, key, render, source=None):
+        """Get a frame from the effect's frame cache, calling render() to make it if missing.
+        The cache is emptied whenever `source`, identifying what the frames depend on, changes."""
+        return self._frames.get(key, render, source)
+
+    def is_finished(self, time):
+        """Whether the effect has ended, so will render nothing from `time` onwards"""
+        return False
+
+    def is_static(self, time):
+        """Whether the output will stay the same from `time` onwards, once rendered at `time`"""
+        return self.is_finished(time)
+
+    def next_image(self, time, background, out=None, background_key=None):
+        """Render the effect at the given time over the background. If the background is
+        known to be unchanged since an earlier frame, background_key is the same as then."""
         if self.start_time is None:
             self.start_time = time
         self.previous_time = self.time
         self.time = time
         self.background = background
-        self.image = self.render()
+        self.background_key = background_key
+        self.image = self.render() if out is None else self.render_into(out)
         return self.image
 
 
@@ -67,12 +284,19 @@ class BgFX(FXBase):
     def params(self, colours):
         self.img = self.new_image(*colours)
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 10
 
+    def is_static(self, time):
+        return True
+
     def render(self):
         return self.img
 
+    def render_into(self, out):
+        return self.array(self.img)
+
 
 class FadeFX(FXBase):
     def params(self, vals):
@@ -90,19 +314,38 @@ class FadeFX(FXBase):
         imgs.append([tlast, self.new_image(*cols)])
         self.imgs = imgs
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 20
 
+    def is_static(self, time):
+        return time >= self.start_time + self.imgs[-1][0]
+
+    def position(self):
+        # Index of the image being faded to, and how far through the fade we are
+        imgs = self.imgs
+        i = bisect_right(imgs, [self.time - self.start_time])
+        return i, (self.time - self.start_time - imgs[i-1][0]) / (imgs[i][0] - imgs[i-1][0])
+
     def render(self):
         imgs = self.imgs
         if self.time <= self.start_time:
             return imgs[0][1]
         elif self.time >= self.start_time + imgs[-1][0]:
             return imgs[-1][1]
-        i = bisect_right(imgs, [self.time - self.start_time, None])
-        a = (self.time - self.start_time - imgs[i-1][0]) / (imgs[i][0] - imgs[i-1][0])
+        i, a = self.position()
         return Image.blend(imgs[i-1][1], imgs[i][1], a)
 
+    def render_into(self, out):
+        imgs = self.imgs
+        if self.time <= self.start_time:
+            return self.array(imgs[0][1])
+        elif self.time >= self.start_time + imgs[-1][0]:
+            return self.array(imgs[-1][1])
+        i, a = self.position()
+        return self.blend_into(out, self.array(imgs[i-1][1], np.float32),
+                               self.array(imgs[i][1], np.float32), a)
+
 
 class SpinFX(FXBase):
     def params(self, args):
@@ -125,38 +368,88 @@ class SpinFX(FXBase):
         self.imgs = imgs
         return dict(period=period)
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 30
 
+    def is_finished(self, time):
+        return time > self.start_time and time >= self.start_time + self.imgs[-1][0]
+
+    position = FadeFX.position
+
+    def shift(self):
+        return int(self.size[0] * (self.time - self.start_time) / self.period)
+
     def render(self):
         imgs = self.imgs
         if self.time <= self.start_time:
             return imgs[0][1]
         elif self.time >= self.start_time + imgs[-1][0]:
             return None
-        i = bisect_right(imgs, [self.time - self.start_time, None])
-        a = (self.time - self.start_time - imgs[i-1][0]) / (imgs[i][0] - imgs[i-1][0])
+        i, a = self.position()
+        shift = self.shift() % self.size[0]
+        if a == 0 or imgs[i-1][1] is imgs[i][1]:
+            # Not fading, so only the rotation changes
+            img = imgs[i-1][1]
+            return self.cached((id(img), shift), lambda: ImageChops.offset(img, shift, 0))
         img = Image.blend(imgs[i-1][1], imgs[i][1], a)
-        shift = int(img.size[0] * (self.time - self.start_time) / self.period)
         return ImageChops.offset(img, shift, 0)
 
+    def render_into(self, out):
+        imgs = self.imgs
+        if self.time <= self.start_time:
+            return self.array(imgs[0][1])
+        elif self.time >= self.start_time + imgs[-1][0]:
+            return None
+        i, a = self.position()
+        shift = self.shift() % self.size[0]
+        if a == 0 or imgs[i-1][1] is imgs[i][1]:
+            img = imgs[i-1][1]
+            return self.cached((id(img), shift),
+                               lambda: self.offset_into(out, self.array(img), shift))
+        img = self.blend_into(self.buffer('spin', out.shape),
+                              self.array(imgs[i-1][1], np.float32),
+                              self.array(imgs[i][1], np.float32), a)
+        return self.offset_into(out, img, shift)
+
 
 class RotateFX(FXBase):
     def params(self, args):
         return dict(period=1 if len(args) < 1 else args[0],
                     reps=-1 if len(args) < 2 else args[1])
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 40
 
+    def is_finished(self, time):
+        return self.reps >= 0 and time > self.start_time + self.period * self.reps
+
+    def shift(self):
+        return int(self.size[0] * (self.time - self.start_time) / self.period)
+
     def render(self):
         if self.reps >= 0 and self.time > self.start_time + self.period * self.reps:
             return None
-        shift = int(self.size[0] * (self.time - self.start_time) / self.period)
-        return ImageChops.offset(self.background, shift, 0)
+        shift = self.shift() % self.size[0]
+        if self.background_key is None:
+            return ImageChops.offset(self.background, shift, 0)
+        return self.cached(shift, lambda: ImageChops.offset(self.background, shift, 0),
+                           self.background_key)
+
+    def render_into(self, out):
+        if self.reps >= 0 and self.time > self.start_time + self.period * self.reps:
+            return None
+        shift = self.shift() % self.size[0]
+        if self.background_key is None:
+            return self.offset_into(out, self.background, shift)
+        return self.cached(shift, lambda: self.offset_into(out, self.background, shift),
+                           self.background_key)
 
 
 class ChaseFX(FXBase):
+    SUBPIXELS = 16  # Sub-pixel steps the sprite is positioned in
+
     def params(self, args):
         period = 1
         if len(args) > 0 and isinstance(args[0], Number):
@@ -184,27 +477,17 @@ class ChaseFX(FXBase):
             args = args[1:]
 
         sprite_cols = args if len(args) > 0 else ['white']
-        sprite_size = (width, self.size[1])
-        self.sprite = self.new_image(*sprite_cols, size=sprite_size)
-        pix = self.sprite.load()
-        for x in range(min(fade, (width + 1) // 2)):
-            v = (x + 1) / (fade + 1)
-            for y in range(self.size[1]):
-                p = pix[x, y]
-                pix[x, y] = p[0:3] + (int(p[3] * v),)
-                if x < width // 2:
-                    # Dont double-fade central pixel on odd widths
-                    p = pix[width - 1 - x, y]
-                    pix[width - 1 - x, y] = p[0:3] + (int(p[3] * v),)
+        self.sprite = self.new_sprite(sprite_cols, width, fade)
         return dict(period=period, stop=stop, reps=reps, width=width, fade=fade)
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 50
 
-    def render(self):
-        if self.reps >= 0 and (self.time > self.start_time + abs(self.period) * self.reps):
-            return None
-        img = self.new_image()
+    def is_finished(self, time):
+        return self.reps >= 0 and time > self.start_time + abs(self.period) * self.reps
+
+    def position(self):
         t = self.time - self.start_time
         if self.period < 0:
             t -= self.period
@@ -216,9 +499,19 @@ class ChaseFX(FXBase):
         a = min(1.0, t / abs(self.period * (1.0 - self.stop)))
         if d < 0:
             a = 1.0 - a
-        x = round(a * (self.size[0] - self.width))
-        img.paste(self.sprite, (x, 0))
-        return img
+        return a * (self.size[0] - self.width)
+
+    def render(self):
+        if self.reps >= 0 and (self.time > self.start_time + abs(self.period) * self.reps):
+            return None
+        return Sprite(self.sprite, round(self.position()), 0)
+
+    def render_into(self, out):
+        if self.reps >= 0 and (self.time > self.start_time + abs(self.period) * self.reps):
+            return None
+        # Quantise the position so the anti-aliased sprites can be cached
+        x = round(self.position() * self.SUBPIXELS) / self.SUBPIXELS
+        return self.cached(x, lambda: self.sprite_into(self.sprite, x))
 
 
 class SlideFX(FXBase):
@@ -236,33 +529,31 @@ class SlideFX(FXBase):
             fade = args[0]
             args = args[1:]
         sprite_cols = args if len(args) > 0 else ['white']
-        sprite_size = (width, self.size[1])
-        self.sprite = self.new_image(*sprite_cols, size=sprite_size)
-        pix = self.sprite.load()
-        for x in range(min(fade, (width + 1) // 2)):
-            v = (x + 1) / (fade + 1)
-            for y in range(self.size[1]):
-                p = pix[x, y]
-                pix[x, y] = p[0:3] + (int(p[3] * v),)
-                if x < width // 2:
-                    # Dont double-fade central pixel on odd widths
-                    p = pix[width - 1 - x, y]
-                    pix[width - 1 - x, y] = p[0:3] + (int(p[3] * v),)
+        self.sprite = self.new_sprite(sprite_cols, width, fade)
         return dict(period=period, width=width, fade=fade)
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 60
 
-    def render(self):
-        if self.time > self.start_time + abs(self.period):
-            return None
-        img = self.new_image()
+    def is_finished(self, time):
+        return time > self.start_time + abs(self.period)
+
+    def position(self):
         a = (self.time - self.start_time) / abs(self.period)
         if self.period < 0:
             a = 1 - a
-        x = round(a * (self.size[0] + self.width) - self.width)
-        img.paste(self.sprite, (x, 0))
-        return img
+        return a * (self.size[0] + self.width) - self.width
+
+    def render(self):
+        if self.time > self.start_time + abs(self.period):
+            return None
+        return Sprite(self.sprite, round(self.position()), 0)
+
+    def render_into(self, out):
+        if self.time > self.start_time + abs(self.period):
+            return None
+        return self.sprite_into(self.sprite, self.position())
 
 
 class FlashFX(FXBase):
@@ -275,9 +566,13 @@ class FlashFX(FXBase):
         self.trans = self.new_image()
         return dict(period=period)
 
-    def default_layer(self):
+    @classmethod
+    def default_layer(cls):
         return 70
 
+    def is_finished(self, time):
+        return time > self.start_time + self.period
+
     def render(self):
         if self.time > self.start_time + self.period:
             return None
@@ -286,8 +581,20 @@ class FlashFX(FXBase):
         a = (self.time - self.start_time) / self.period
         return Image.blend(self.img, self.trans, a)
 
+    def render_into(self, out):
+        if self.time > self.start_time + self.period:
+            return None
+        if self.period <= 0:
+            return self.array(self.img)
+        a = (self.time - self.start_time) / self.period
+        return self.blend_into(out, self.array(self.img, np.float32),
+                               self.array(self.trans, np.float32), a)
+
 
 class SparkleFX(FXBase):
+    DECAYS = ('linear', 'exp')
+    EXP_RATE = 5  # Exponential decay rate, relative to the fade time
+
     def params(self, args):
         period = 0
         if len(args) > 0 and isinstance(args[0], Number):
@@ -301,43 +608,106 @@ class SparkleFX(FXBase):
         if len(args) > 0 and isinstance(args[0], Number):
             nspark = args[0]
             args = args[1:]
-        colours = [ImageColor.getrgb(c) for c in (args if len(args) > 0 else ['white'])]
-        self.img = self.new_image()
-        return dict(period=period, fade=fade, nspark=nspark, colours=colours)
-
-    def default_layer(self):
+        decay = 'linear'
+        if len(args) > 0 and args[0] in SparkleFX.DECAYS:
+            decay = args[0]
+            args = args[1:]
+        colours = [colour.getrgba(c) for c in (args if len(args) > 0 else ['white'])]
+        # Sparks that are still visible, as (birth time, x, y, colour), oldest first
+        self.live = deque()
+        # Pixels drawn into the buffer on the previous frame
+        self.drawn = []
+        return dict(period=period, fade=fade, nspark=nspark, decay=decay, colours=colours)
+
+    @classmethod
+    def default_layer(cls):
         return 80
 
+    def is_finished(self, time):
+        return time > self.start_time + self.period + self.fade
+
+    def sparks(self):
+        # Place sparks over the whole canvas, so that each part of it makes the same random calls
+        for i in range(self.nspark):
+            c = self.rng.choice(self.colours)
+            x = self.rng.randrange(self.canvas[0]) - self.origin[0]
+            y = self.rng.randrange(self.canvas[1]) - self.origin[1]
+            if 0 <= x < self.size[0] and 0 <= y < self.size[1]:
+                yield x, y, c
+
+    def update(self):
+        # Forget sparks that have faded out, then add new ones while still sparkling
+        live = self.live
+        while live and self.time > live[0][0] and self.time - live[0][0] >= self.fade:
+            live.popleft()
+        if self.time < self.start_time + self.period:
+            live.extend((self.time, x, y, c) for x, y, c in self.sparks())
+
+    def faded(self, birth, c):
+        # The colour of a spark, faded according to its age
+        age = self.time - birth
+        if age <= 0:
+            return c
+        if self.decay == 'exp':
+            a = exp(-SparkleFX.EXP_RATE * age / self.fade)
+        else:
+            a = 1 - age / self.fade
+        return c[:3] + (int(c[3] * a + 0.5),)
+
     def render(self):
         if self.time > self.start_time + self.period + self.fade:
             return None
-        pix = self.img.load()
-        if self.previous_time is not None:
-            nfade = 255 if self.fade <= 0 else round((self.time - self.previous_time)
-                                                     * 255 / self.fade)
-            for y in range(self.size[1]):
-                for x in range(self.size[0]):
-                    p = pix[x, y]
-                    pix[x, y] = p[:3] + (max(0, p[3] - nfade),)
-        if self.time < self.start_time + self.period:
-            for i in range(self.nspark):
-                pix[randrange(self.size[0]), randrange(self.size[1])] = choice(self.colours)
-        return self.img
+        self.update()
+        # A fresh image, since the shared transparent one would have to be copied anyway
+        img = Image.new('RGBA', self.size)
+        pix = img.load()
+        for birth, x, y, c in self.live:
+            pix[x, y] = self.faded(birth, c)
+        return img
+
+    def render_into(self, out):
+        if self.time > self.start_time + self.period + self.fade:
+            return None
+        self.update()
+        # Only the pixels that held sparks need clearing, so cost depends on the number of sparks
+        pix = self.buffer('sparkle', out.shape)
+        for y, x in self.drawn:
+            pix[y, x] = 0
+        self.drawn = []
+        for birth, x, y, c in self.live:
+            pix[y, x] = self.faded(birth, c)
+            self.drawn.append((y, x))
+        return pix
 
 
 class FlameFX(FXBase):
     # Adapted from https://www.tweaking4all.com/hardware/arduino/adruino-led-strip-effects/#fire
     EXTRA = 10  # Extra pixels before start of strip where sparks are generated
+    DIFFUSION = 0.1  # Fraction of heat spreading to each neighbouring column in a vertical flame
 
     def params(self, args):
         sparking = args[0] if len(args) > 0 else 1  # Average number of sparks per frame
         cooling = args[1] if len(args) > 1 else 1  # Cooling rate
         kernel = self.parse_kernel(args[2]) if len(args) > 2 else [0, 1, 2]  # Drift + diffusion
-        self.flame = [0.0] * (self.size[0] + FlameFX.EXTRA)
+        # 'x' for a flame along the strip, 'y' for flames rising up each column of a matrix
+        vertical = len(args) > 3 and args[3] == 'y' and np is not None
         self.palette = colour.scale('flame')
-        return dict(sparking=sparking, cooling=cooling, kernel=kernel)
-
-    def default_layer(self):
+        if np is None:
+            self.flame = [0.0] * (self.size[0] + FlameFX.EXTRA)
+        else:
+            # A vertical flame always covers the whole canvas height, so that it looks the same
+            # however the canvas is split up for rendering
+            length = (self.canvas[1] if vertical else self.size[0]) + FlameFX.EXTRA
+            self.flame = np.zeros((length, self.size[0] if vertical else 1))
+            # Total kernel weight that falls within the flame at each position
+            weights = np.zeros(length)
+            weights[:len(kernel)] = kernel[:length]
+            self.norm = np.cumsum(weights)[:, None]
+            self.weighted = self.norm > 0
+        return dict(sparking=sparking, cooling=cooling, kernel=kernel, vertical=vertical)
+
+    @classmethod
+    def default_layer(cls):
         return 90
 
     def parse_kernel(self, s):
@@ -350,14 +720,64 @@ class FlameFX(FXBase):
         p = 1
         while p > l:
             k += 1
-            p *= random()
+            p *= self.rng.random()
         return k - 1
 
+    def simulate(self):
+        f = self.flame
+        n = len(f)
+        # Cool down every cell a little, clamping heat to a minimum of 0
+        f -= self.np_rng.random_sample(f.shape) * (3 * self.cooling / n)
+        np.maximum(f, 0.0, out=f)
+        # Heat from each cell drifts 'up' and diffuses a little
+        s = self.buffer('sum', f.shape, float)
+        tmp = self.buffer('tmp', f.shape, float)
+        s[...] = 0
+        for k, v in enumerate(self.kernel):
+            if v and k < n:
+                np.multiply(f[:n - k], v, out=tmp[k:])
+                s[k:] += tmp[k:]
+        # Wherever the total kernel weight is 0, so is the sum
+        np.divide(s, self.norm, out=s, where=self.weighted)
+        f[1:] = s[1:]
+        if self.vertical and f.shape[1] > 1:
+            edge = np.pad(f, ((0, 0), (1, 1)), mode='edge')
+            f *= 1 - 2 * FlameFX.DIFFUSION
+            f += FlameFX.DIFFUSION * (edge[:, :-2] + edge[:, 2:])
+        # Randomly ignite new 'sparks' off the end of each flame, with heat in range 0.5 - 1
+        counts = self.np_rng.poisson(self.sparking, f.shape[1])
+        total = counts.sum()
+        if total:
+            rows = (self.np_rng.random_sample(total) * FlameFX.EXTRA).astype(int)
+            cols = np.repeat(np.arange(f.shape[1]), counts)
+            np.add.at(f, (rows, cols), self.np_rng.random_sample(total) * 0.5 + 0.5)
+            np.minimum(f, 1.0, out=f)
+
+    def colours(self):
+        # Convert heat to LED colors, as an array of the image size
+        rgba = self.palette.map(self.flame[FlameFX.EXTRA:])
+        if self.vertical:
+            # The flame rises from the bottom of the canvas
+            top = self.origin[1]
+            return rgba[::-1][top:top + self.size[1]]
+        return np.broadcast_to(rgba.reshape(1, -1, 4), (self.size[1], self.size[0], 4))
+
     def render(self):
+        if np is None:
+            return self.render_python()
+        self.simulate()
+        return Image.fromarray(np.ascontiguousarray(self.colours()))
+
+    def render_into(self, out):
+        self.simulate()
+        np.copyto(out, self.colours())
+        return out
+
+    def render_python(self):
         f = self.flame
         # Cool down every cell a little
         for i in range(len(f)):
-            f[i] -= random() * 3 * self.cooling / len(f)
+            f[i] -= self.rng.random() * 3 * self.cooling / len(f)
             if f[i] < 0.0:
                 # Clamp pixel heat to minimum of 0
                 f[i] = 0.0
@@ -373,17 +793,63 @@ class FlameFX(FXBase):
         # Randomly ignite new 'sparks' off the end of the strip
         for i in range(self.nsparks()):
             # Pick a random pixel in the off-strip area
-            pos = int(random() * FlameFX.EXTRA)
+            pos = int(self.rng.random() * FlameFX.EXTRA)
             # Spark heat in range 0.5 - 1
-            f[pos] += random() * 0.5 + 0.5
+            f[pos] += self.rng.random() * 0.5 + 0.5
             if f[pos] > 1.0:
                 # Clamp pixel heat to maximum of 1
                 f[pos] = 1.0
         # Convert heat to LED colors
-        img = self.new_image()
-        pix = img.load()
-        for i in range(self.size[0]):
-            p = self.palette(f[i + FlameFX.EXTRA])
-            for j in range(self.size[1]):
-                pix[i, j] = p
+        strip = Image.new('RGBA', (self.size[0], 1))
+        strip.putdata(self.palette.map(f[FlameFX.EXTRA:]))
+        return strip.resize(self.size, Image.NEAREST)
+
+
+class PlayFX(FXBase):
+    """Plays a show file pre-rendered by offline.py, from an offset in seconds"""
+    def params(self, args):
+        path = args[0] if len(args) > 0 else ''
+        offset = args[1] if len(args) > 1 else 0
+        if not os.path.splitext(path)[1]:
+            path += '.show'
+        self.recording = None
+        try:
+            self.recording = show.open_show(path)
+        except (OSError, ValueError) as e:
+            print("Can't play show:", e)
+        if self.recording is not None and self.recording.size != tuple(self.canvas):
+            print("Show size {} doesn't match LEDs {}".format(self.recording.size, self.canvas))
+            self.recording = None
+        return dict(path=path, offset=offset)
+
+    @classmethod
+    def default_layer(cls):
+        return 25
+
+    def position(self, time):
+        # Allow for the period only being stored to single precision
+        return max(0, int((time - self.start_time + self.offset) / self.recording.period + 1e-3))
+
+    def is_finished(self, time):
+        return (self.recording is None or
+                (time > self.start_time and self.position(time) >= self.recording.frames))
+
+    def render(self):
+        if self.is_finished(self.time):
+            return None
+        img = Image.frombuffer('RGB', self.canvas, self.recording.frame(self.position(self.time)),
+                               'raw', 'BGRX', 0, 1).convert('RGBA')
+        if self.size != self.canvas:
+            x, y = self.origin
+            img = img.crop((x, y, x + self.size[0], y + self.size[1]))
         return img
+
+    def render_into(self, out):
+        if self.is_finished(self.time):
+            return None
+        x, y = self.origin
+        frame = self.recording.pixels[self.position(self.time),
+                                      y:y + self.size[1], x:x + self.size[0]]
+        np.copyto(out[..., :3], frame[..., 2::-1])
+        out[..., 3] = 255
+        return out
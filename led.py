@@ -1,22 +1,76 @@
 import colour
 from PIL import ImageColor
-from fakepixel import Fake_NeoPixel
+from fakepixel import Fake_NeoPixel, Null_NeoPixel
+from functools import partial
+from net import PROTOCOLS, NetworkPixels
+from output import OutputThread
+from time import perf_counter
+try:
+    import numpy as np
+except ImportError:
+    np = None
+else:
+    CHANNELS = np.arange(3)
 try:
     from neopixel import Adafruit_NeoPixel, Color, ws
+    from pwm import PWM_PINS, PWMPixels
     realpixels = True
 except ImportError:
     from fakepixel import Color, ws
     realpixels = False
 
 
-def col(c, gamma=None):
+def col(c, table=None):
     if not isinstance(c, tuple):
         c = ImageColor.getrgb(c)
-    if gamma:
-        c = tuple(int(((i / 255.0) ** gamma) * 255) for i in c)
+    if table is not None:
+        c = tuple(int(table[v][i]) for i, v in enumerate(c[:3]))
     return Color(*c[:3])
 
 
+def correction_table(gamma=None, bright=255, balance=(1, 1, 1)):
+    """Build a lookup table mapping each 8 bit channel value to its corrected value.
+    Gamma is applied first, then the result is scaled by the brightness and the
+    white balance factor of each R, G, B channel. The table is indexed by [value][channel]."""
+    table = [[min(255, int((((i / 255.0) ** gamma) * 255 if gamma else i) * b * bright / 255))
+              for b in balance]
+             for i in range(256)]
+    if np is not None:
+        return np.array(table, dtype=np.uint32)
+    return table
+
+
+def pack(image, table):
+    """Convert an RGB(A) image to a sequence of Color values, one per pixel"""
+    if np is not None:
+        rgb = table[np.asarray(image)[..., :3], CHANNELS].reshape(-1, 3)
+        return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    return [Color(table[c[0]][0], table[c[1]][1], table[c[2]][2]) for c in image.getdata()]
+
+
+def changed_spans(old, new, gap=4):
+    """Find the [start, end) ranges of pixels that differ between two packed frames.
+    Runs separated by no more than `gap` unchanged pixels are merged into one span."""
+    if old is None or len(old) != len(new):
+        return [(0, len(new))]
+    if np is not None:
+        idx = np.flatnonzero(old != new)
+        if len(idx) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(idx) > gap + 1)
+        starts = np.concatenate((idx[:1], idx[breaks + 1]))
+        ends = np.concatenate((idx[breaks], idx[-1:])) + 1
+        return list(zip(starts.tolist(), ends.tolist()))
+    spans = []
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            if spans and i - spans[-1][1] <= gap:
+                spans[-1][1] = i + 1
+            else:
+                spans.append([i, i + 1])
+    return [tuple(s) for s in spans]
+
+
 class LEDStrip:
     STRIPS = {'rgb': ws.WS2811_STRIP_RGB,
               'rbg': ws.WS2811_STRIP_RBG,
@@ -26,51 +80,162 @@ class LEDStrip:
               'bgr': ws.WS2811_STRIP_BGR,
               'rgbw': ws.SK6812_STRIP_RGBW}
 
-    def __init__(self, kind, leds, freq, pin, dma, channel, strip, invert, bright, gamma, debug):
+    def __init__(self, kind, leds, freq, pin, dma, channel, strip, invert, bright, gamma, debug,
+                 threaded=False, profile=None, mapping=None, width=None, max_fps=0):
         # bg: solid, gradient, fade
         # fg: drop, flash, sparkle
-        strip_type = self.STRIPS[strip]
         self._gamma = gamma
-        if kind == 'real' or (kind == 'auto' and realpixels):
-            if not realpixels:
-                raise Exception("Can't load library for real pixels")
-            self.leds = Adafruit_NeoPixel(leds, pin, freq, dma, invert,
-                                          bright, channel, strip_type)
-        else:
-            self.leds = Fake_NeoPixel(leds, pin, freq, dma, invert,
-                                      bright, channel, strip_type, debug)
-        # Intialize the library (must be called once before other functions).
-        self.leds.begin()
+        self._bright = bright
+        self._balance = (1, 1, 1)
+        self._table = correction_table(gamma, bright)
+        self.profile = profile
+        # Without a mapping, there is one output showing the canvas in row-major order
+        self.mapping = mapping
+        outputs = [{}] if mapping is None else mapping.outputs
+        self.bounds = [(0, leds)] if mapping is None else mapping.bounds
+        self.count = self.bounds[-1][1]
+        real = kind == 'real' or (kind == 'auto' and realpixels)
+        if real and not realpixels:
+            raise Exception("Can't load library for real pixels")
+        # Real outputs on PWM pins share the PWM hardware, so are driven as channels of one device
+        pwm_outputs = [i for i, o in enumerate(outputs)
+                       if real and 'protocol' not in o and o.get('gpio', pin) in PWM_PINS]
+        pwm = None
+        self.drivers = []  # What each output's pixels are written to
+        self.devices = []  # Each device that is shown, with the outputs it shows
+        # Fake outputs share the terminal, so are shown together in one display, a line each
+        fake_outputs = [i for i, o in enumerate(outputs)
+                        if not real and kind != 'null' and 'protocol' not in o]
+        fake = None
+        if len(fake_outputs) > 1:
+            sizes = [self.bounds[i][1] - self.bounds[i][0] for i in fake_outputs]
+            fake = Fake_NeoPixel(sum(sizes), pin, freq, dma, invert, 255, channel,
+                                 self.STRIPS[strip], debug, None, max_fps, sizes)
+            self.devices.append((fake, fake_outputs))
+        for i, (o, (start, end)) in enumerate(zip(outputs, self.bounds)):
+            # Brightness is applied via the correction table, so the drivers always run at full
+            settings = (end - start, o.get('gpio', pin), o.get('freq', freq), o.get('dma', dma),
+                        o.get('invert', invert), 255, o.get('channel', channel),
+                        self.STRIPS[o.get('strip', strip)])
+            if len(pwm_outputs) > 1 and i in pwm_outputs:
+                if pwm is None:
+                    pwm = PWMPixels(settings[2], settings[3])
+                    self.devices.append((pwm, []))
+                elif (pwm.freq, pwm.dma) != settings[2:4]:
+                    raise ValueError("Outputs on PWM pins must use the same freq and dma")
+                self.drivers.append(pwm.add_channel(*settings[:2], settings[4], 255, settings[7]))
+                next(d for d in self.devices if d[0] is pwm)[1].append(i)
+                continue
+            if fake is not None and i in fake_outputs:
+                self.drivers.append(fake.segments[fake_outputs.index(i)])
+                continue
+            if 'protocol' in o:
+                driver = PROTOCOLS[o['protocol']](end - start, o.get('host'), o.get('port'),
+                                                  o.get('sync', False), o.get('universe'))
+            elif real:
+                driver = Adafruit_NeoPixel(*settings)
+            elif kind == 'null':
+                driver = Null_NeoPixel(*settings, debug)
+            else:
+                # Shown as a matrix if the LEDs are in canvas order, with width LEDs per row
+                driver = Fake_NeoPixel(*settings, debug, width if mapping is None else None,
+                                       max_fps)
+            self.drivers.append(driver)
+            self.devices.append((driver, [i]))
+        for device, _ in self.devices:
+            # Intialize the library (must be called once before other functions).
+            device.begin()
+        self._last = [None] * len(self.drivers)  # Packed frame currently on each output, if known
+        # Several devices are always sent from their own threads, so they update in parallel
+        self.outputs = []
+        if threaded or len(self.devices) > 1:
+            self.outputs = [OutputThread(partial(self._send, d)) for d in range(len(self.devices))]
+            for output in self.outputs:
+                output.start()
+
+    def close(self):
+        for output in self.outputs:
+            output.stop()
+        self.outputs = []
+        for device, _ in self.devices:
+            if isinstance(device, NetworkPixels):
+                device.close()
 
     def brightness(self, bright):
-        self.leds.setBrightness(bright)
-        self._display()
+        self._bright = bright
+        self._update_table()
 
     def gamma(self, val):
         self._gamma = val
-        self._display()
+        self._update_table()
+
+    def white_balance(self, red, green, blue):
+        self._balance = (red, green, blue)
+        self._update_table()
+
+    def _update_table(self):
+        # Only takes effect on the next frame written to the strip
+        self._table = correction_table(self._gamma, self._bright, self._balance)
 
     def clear(self):
         self.solid('#000')
 
     def solid(self, colour):
-        n = self.leds.numPixels()
-        c = col(colour, self._gamma)
-        self.leds.setPixelColor(slice(0, n), [c]*n)
-        self._display()
+        c = col(colour, self._table)
+        self._write([c] * self.count)
 
     def gradient(self, colour1, colour2):
-        n = self.leds.numPixels()
-        pix = [col(c, self._gamma) for c in colour.Color(colour1).range_to(colour2, n)]
-        self.leds.setPixelColor(slice(0, n), pix)
-        self._display()
+        n = self.count
+        sc = colour.scale(colour1, colour2)
+        self._write([col(sc(0.5 if n < 2 else i / (n - 1.0)), self._table) for i in range(n)])
 
     def image(self, image):
-        data = image.getdata()
-        n = min(self.leds.numPixels(), len(data))
-        pix = [col(c, self._gamma) for c in data]
-        self.leds.setPixelColor(slice(0, n), pix)
-        self._display()
-
-    def _display(self):
-        self.leds.show()
+        if self.profile is not None:
+            start = perf_counter()
+            pix = self._convert(image)
+            self.profile.add('convert', perf_counter() - start)
+        else:
+            pix = self._convert(image)
+        self._write(pix)
+
+    def _convert(self, image):
+        pix = pack(image, self._table)
+        if self.mapping is not None:
+            return self.mapping.remap(pix)
+        return pix[:min(self.count, len(pix))]
+
+    def _write(self, pix):
+        if np is not None:
+            pix = np.asarray(pix, dtype=np.uint32)
+        for d in range(len(self.devices)):
+            if self.outputs:
+                self.outputs[d].submit(pix)
+            else:
+                self._send(d, pix)
+
+    def _send(self, d, pix):
+        # Update the changed pixels of each of the device's outputs, then show them all at once
+        changed = False
+        for i in self.devices[d][1]:
+            start, end = self.bounds[i]
+            out = pix[start:end]
+            spans = changed_spans(self._last[i], out)
+            for s, e in spans:
+                vals = out[s:e]
+                if np is not None:
+                    # The native library expects plain ints rather than numpy scalars
+                    vals = vals.tolist()
+                self.drivers[i].setPixelColor(slice(s, e), vals)
+            if spans:
+                self._last[i] = out
+                changed = True
+        if changed:
+            self._display(d)
+
+    def _display(self, d):
+        if self.profile is not None:
+            start = perf_counter()
+            self.devices[d][0].show()
+            self.profile.add('show', perf_counter() - start)
+        else:
+            self.devices[d][0].show()
@@ -0,0 +1,96 @@
+"""Mapping of canvas pixels to LEDs on one or more outputs, loaded from a JSON file such as:
+
+    {"outputs": [{"gpio": 18, "channel": 0, "dma": 10},
+                 {"gpio": 13, "channel": 1, "dma": 11}],
+     "panels": [{"output": 0, "x": 0, "y": 0, "width": 16, "height": 16, "serpentine": true},
+                {"output": 1, "x": 16, "y": 0, "width": 16, "height": 16, "serpentine": true,
+                 "rotate": 180}]}
+
+Each panel covers a rectangle of the canvas. Its LEDs are wired along rows from its top left
+corner, before it is rotated clockwise by `rotate` degrees (a multiple of 90). With serpentine
+wiring every other row runs backwards. Panels follow on from each other along their output,
+unless one gives its first LED's `start` index. An output may also give its number of `leds`,
+and its own `gpio`, `channel`, `dma`, `freq`, `strip` and `invert` settings. Outputs on the
+two PWM channels (such as GPIO 18 and 13) are driven together, so must use the same dma and freq.
+
+An output with a `protocol` (e131, artnet or ddp) sends to a network node at `host`
+(and optionally `port`) instead, starting from `universe`, with sync packets if `sync` is true."""
+
+import json
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def panel_pixels(width, height, serpentine=False, rotate=0):
+    """The (x, y) position within the panel of each LED along its wiring"""
+    if rotate % 90 != 0:
+        raise ValueError("Panels can only be rotated by multiples of 90 degrees")
+    rotate %= 360
+    # Size of the panel as it is wired, before rotation
+    w, h = (width, height) if rotate in (0, 180) else (height, width)
+    for k in range(w * h):
+        r, c = divmod(k, w)
+        if serpentine and r % 2:
+            c = w - 1 - c
+        if rotate == 0:
+            yield c, r
+        elif rotate == 90:
+            yield h - 1 - r, c
+        elif rotate == 180:
+            yield w - 1 - c, h - 1 - r
+        else:
+            yield r, w - 1 - c
+
+
+class Mapping:
+    """Compiles panels into an index of the canvas pixel shown by each LED, with the LEDs of all
+    the outputs one after another, so that a frame is remapped with a single gather"""
+    def __init__(self, size, outputs, panels):
+        width, height = size
+        self.size = size
+        self.outputs = [dict(o) for o in outputs]
+        leds = [{} for o in outputs]
+        for p in panels:
+            out = leds[p.get('output', 0)]
+            x0, y0 = p.get('x', 0), p.get('y', 0)
+            if x0 < 0 or y0 < 0 or x0 + p['width'] > width or y0 + p['height'] > height:
+                raise ValueError("Panel doesn't fit in the canvas: {}".format(p))
+            i = p.get('start', max(out, default=-1) + 1)
+            for x, y in panel_pixels(p['width'], p['height'], p.get('serpentine', False),
+                                     p.get('rotate', 0)):
+                if i in out:
+                    raise ValueError("LED {} is mapped more than once: {}".format(i, p))
+                out[i] = (y0 + y) * width + x0 + x
+                i += 1
+        # LEDs not in any panel (-1) are left black
+        self.index = []
+        self.bounds = []
+        for o, out in zip(self.outputs, leds):
+            count = max(o.get('leds', 0), max(out, default=-1) + 1)
+            start = len(self.index)
+            self.index += [out.get(i, -1) for i in range(count)]
+            self.bounds.append((start, len(self.index)))
+        self.unmapped = None
+        if np is not None:
+            self.index = np.array(self.index, dtype=np.intp)
+            unmapped = np.flatnonzero(self.index < 0)
+            if len(unmapped):
+                self.unmapped = unmapped
+                self.index[unmapped] = 0
+
+    @classmethod
+    def load(cls, path, size):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(size, spec.get('outputs', [{}]), spec['panels'])
+
+    def remap(self, pix):
+        """Reorder the packed pixels of a canvas into the order of the LEDs on the outputs"""
+        if np is not None:
+            res = np.take(pix, self.index)
+            if self.unmapped is not None:
+                res[self.unmapped] = 0
+            return res
+        return [pix[i] if i >= 0 else 0 for i in self.index]
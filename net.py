@@ -0,0 +1,244 @@
+"""Drivers that send pixels to network nodes (such as ESP32s running WLED) over UDP,
+using the E1.31 (sACN), Art-Net or DDP protocols, with the same interface as Adafruit_NeoPixel"""
+
+import socket
+import struct
+import threading
+import uuid
+from abc import ABCMeta, abstractmethod
+from time import monotonic
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SOURCE_NAME = b'sonic-pixels'
+
+
+class NetworkPixels(object, metaclass=ABCMeta):
+    """Each packet is built once, and pixels are written straight into its payload.
+    Only packets with changed pixels are sent on show(), but everything is resent
+    after a while without sending, so that nodes don't time out while the LEDs are static."""
+    PORT = None
+    PER_PACKET = None  # Pixels in each packet
+    FIRST_UNIVERSE = 0
+    MULTICAST = False  # Whether packets can be sent without a host
+    KEEPALIVE = 1.0  # Seconds
+    RETRY = 5.0  # Seconds between attempts to look up a host that doesn't resolve
+
+    def __init__(self, num, host=None, port=None, sync=False, universe=None):
+        if host is None and not self.MULTICAST:
+            raise ValueError("{} needs a host to send to".format(type(self).__name__))
+        self.num = num
+        self.host = host
+        self.port = port or self.PORT
+        self.ip = None  # Address of the host, looked up when first sending
+        self.next_lookup = 0
+        self.error = None  # Why the last send failed, if it did
+        self.sync = sync
+        self.universe = self.FIRST_UNIVERSE if universe is None else universe
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.packets = []
+        self.offsets = []  # Where the pixels start in each packet
+        for k, start in enumerate(range(0, num, self.PER_PACKET)):
+            count = min(self.PER_PACKET, num - start)
+            header = self.header(k, start, count)
+            self.offsets.append(len(header))
+            self.packets.append(bytearray(header) + bytearray(self.payload_size(count)))
+        self.sequences = [0] * len(self.packets)
+        self.dirty = set()
+        self.sent = monotonic()
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.keepalive = threading.Thread(target=self._keepalive, name='net-keepalive',
+                                          daemon=True)
+
+    @abstractmethod
+    def header(self, k, start, count):
+        """The bytes preceding the pixels in packet k, which holds count pixels from start"""
+        pass
+
+    def payload_size(self, count):
+        return 3 * count
+
+    def address(self, k):
+        return (self.ip, self.port)
+
+    def prepare(self, k, last):
+        """Patch packet k before sending, e.g. with its sequence number"""
+        pass
+
+    def sync_packet(self):
+        return None, None
+
+    def begin(self):
+        self.keepalive.start()
+
+    def close(self):
+        with self.lock:
+            self.closed.set()
+            self.sock.close()
+
+    def numPixels(self):
+        return self.num
+
+    def setPixelColor(self, i, c):
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(self.num)
+        else:
+            start, stop, c = i, i + 1, [c]
+        if stop <= start:
+            return
+        if np is not None:
+            # Little endian Color words are B, G, R, W bytes
+            rgb = np.asarray(c, '<u4').view(np.uint8).reshape(-1, 4)[:, 2::-1].tobytes()
+        else:
+            rgb = b''.join(bytes(((v >> 16) & 255, (v >> 8) & 255, v & 255)) for v in c)
+        n = self.PER_PACKET
+        with self.lock:
+            for k in range(start // n, (stop - 1) // n + 1):
+                a, b = max(start, k * n), min(stop, (k + 1) * n)
+                offset = self.offsets[k] + 3 * (a - k * n)
+                self.packets[k][offset:offset + 3 * (b - a)] = rgb[3 * (a - start):3 * (b - start)]
+                self.dirty.add(k)
+
+    def show(self):
+        with self.lock:
+            self._send(sorted(self.dirty))
+
+    def _send(self, ks):
+        # Nodes come and go (e.g. off Wi-Fi), so failures are reported once and the packets
+        # left dirty to be sent again, rather than stopping the frames
+        try:
+            if self.host is not None and self.ip is None and not self._lookup():
+                return
+            for i, k in enumerate(ks):
+                self.prepare(k, i == len(ks) - 1)
+                self.sock.sendto(self.packets[k], self.address(k))
+            if self.sync and ks:
+                packet, addr = self.sync_packet()
+                self.sock.sendto(packet, addr)
+        except OSError as e:
+            if self.error is None:
+                print("Can't send to {}: {}".format(self.host or 'multicast', e))
+            self.error = e
+            # Look the host up again, in case its address has changed
+            self.ip = None
+            return
+        if self.error is not None:
+            print("Sending to {} again".format(self.host or 'multicast'))
+            self.error = None
+        self.dirty.clear()
+        self.sent = monotonic()
+
+    def _lookup(self):
+        # Resolve the host once rather than on every send, retrying every so often if it fails
+        now = monotonic()
+        if now < self.next_lookup:
+            return False
+        self.next_lookup = now + self.RETRY
+        self.ip = socket.gethostbyname(self.host)
+        return True
+
+    def _keepalive(self):
+        while not self.closed.wait(self.KEEPALIVE / 2):
+            with self.lock:
+                if monotonic() - self.sent >= self.KEEPALIVE:
+                    self._send(range(len(self.packets)))
+
+    def next_sequence(self, k, first=0, last=255):
+        self.sequences[k] = max(first, (self.sequences[k] + 1) % (last + 1))
+        return self.sequences[k]
+
+
+class E131Pixels(NetworkPixels):
+    """Sends to consecutive universes, by multicast unless given a host"""
+    PORT = 5568
+    PER_PACKET = 170
+    FIRST_UNIVERSE = 1
+    MULTICAST = True
+    SEQUENCE = 111  # Offset of the sequence number in the data packets
+
+    def __init__(self, *args, **kwargs):
+        self.cid = uuid.uuid4().bytes
+        super().__init__(*args, **kwargs)
+        self.sync_sequence = 0
+
+    def root_layer(self, length, vector):
+        return struct.pack('>HH12sHI16s', 0x0010, 0, b'ASC-E1.17', 0x7000 | (length - 16), vector,
+                           self.cid)
+
+    def header(self, k, start, count):
+        slots = 3 * count
+        length = 126 + slots
+        return (self.root_layer(length, 0x4) +
+                struct.pack('>HI64sBHBBH', 0x7000 | (length - 38), 0x2, SOURCE_NAME, 100,
+                            self.universe if self.sync else 0, 0, 0, self.universe + k) +
+                struct.pack('>HBBHHHB', 0x7000 | (length - 115), 0x2, 0xa1, 0, 1, slots + 1, 0))
+
+    def address(self, k):
+        universe = self.universe + k
+        if self.host is None:
+            return ('239.255.{}.{}'.format(universe >> 8, universe & 255), self.port)
+        return (self.ip, self.port)
+
+    def prepare(self, k, last):
+        self.packets[k][self.SEQUENCE] = self.next_sequence(k)
+
+    def sync_packet(self):
+        self.sync_sequence = (self.sync_sequence + 1) % 256
+        packet = (self.root_layer(49, 0x8) +
+                  struct.pack('>HIBHH', 0x7000 | 11, 0x1, self.sync_sequence, self.universe, 0))
+        return packet, self.address(0)
+
+
+class ArtNetPixels(NetworkPixels):
+    PORT = 6454
+    PER_PACKET = 170
+    SEQUENCE = 12
+
+    def header(self, k, start, count):
+        universe = self.universe + k
+        return (b'Art-Net\0' + struct.pack('<H', 0x5000) +
+                struct.pack('>HBBBBH', 14, 0, 0, universe & 0xff, (universe >> 8) & 0x7f,
+                            self.payload_size(count)))
+
+    def payload_size(self, count):
+        # The data length must be even
+        return 3 * count + count % 2
+
+    def prepare(self, k, last):
+        self.packets[k][self.SEQUENCE] = self.next_sequence(k, 1)
+
+    def sync_packet(self):
+        packet = b'Art-Net\0' + struct.pack('<H', 0x5200) + struct.pack('>HBB', 14, 0, 0)
+        return packet, self.address(0)
+
+
+class DDPPixels(NetworkPixels):
+    """Without sync, the last packet of each frame has the push flag set, so the node shows it.
+    With sync, a separate push packet follows the data."""
+    PORT = 4048
+    PER_PACKET = 480
+    VERSION = 0x40
+    PUSH = 0x01
+    RGB24 = 0x0b
+    DEVICE = 1
+
+    def header(self, k, start, count):
+        return struct.pack('>BBBBIH', self.VERSION, 0, self.RGB24, self.DEVICE, 3 * start,
+                           3 * count)
+
+    def prepare(self, k, last):
+        packet = self.packets[k]
+        packet[0] = self.VERSION | (self.PUSH if last and not self.sync else 0)
+        packet[1] = self.next_sequence(k, 1, 15)
+
+    def sync_packet(self):
+        packet = struct.pack('>BBBBIH', self.VERSION | self.PUSH, 0, self.RGB24, self.DEVICE, 0, 0)
+        return packet, self.address(0)
+
+
+PROTOCOLS = {'e131': E131Pixels,
+             'artnet': ArtNetPixels,
+             'ddp': DDPPixels}
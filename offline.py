@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Render a log of timestamped OSC commands to a file, faster than real time and without LEDs,
+e.g. `./offline.py session.log --format gif -o session.gif`
+
+Each line of a log is a JSON list of the time in seconds, the OSC address and its arguments,
+as written by `sonic-pixels.py --record`."""
+
+import argparse
+import asyncio
+import json
+from time import time as wall_time
+from PIL import Image
+
+import fx
+from controller import Controller
+from show import ShowWriter
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORMATS = ('raw', 'png', 'gif', 'show')
+
+
+class Recorder:
+    """Wraps an OSC handler, logging each message with its time since the first one.
+    Messages in bundles are logged at the time of their timetag."""
+    def __init__(self, handler, path, clock, bundle_handler=None):
+        self.handler = handler
+        self.bundle_handler = bundle_handler
+        self.file = open(path, 'w')
+        self.clock = clock
+        self.start = None
+
+    def __call__(self, addr, *args):
+        self.log(self.clock(), [(addr, args)])
+        self.handler(addr, *args)
+
+    def bundle(self, timetag, messages):
+        now = self.clock()
+        self.log(max(now, now + timetag - wall_time()), messages)
+        self.bundle_handler(timetag, messages)
+
+    def log(self, time, messages):
+        if self.start is None:
+            self.start = time
+        for addr, args in messages:
+            self.file.write(json.dumps([round(time - self.start, 4), addr] + list(args),
+                                       default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(path):
+    """Read a command log, returning a list of (time, address, args) sorted by time"""
+    cmds = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            time, addr, *args = json.loads(line)
+            cmds.append((time, addr, args))
+    cmds.sort(key=lambda c: c[0])
+    return cmds
+
+
+def render(cmds, size, period, duration):
+    """Render the commands on a virtual clock, yielding each frame as an RGBA image or array"""
+    c = Controller(size[0], size[1], period, None, False)
+    i = 0
+    for frame in range(int(duration / period) + 1):
+        time = frame * period
+        # Apply every command that would have arrived before the frame was rendered
+        while i < len(cmds) and cmds[i][0] <= time:
+            c.handler(cmds[i][1], *cmds[i][2])
+            i += 1
+        yield c.render(time)
+
+
+def to_image(frame, scale=1):
+    if not isinstance(frame, Image.Image):
+        frame = Image.fromarray(frame)
+    frame = frame.convert('RGB')
+    if scale > 1:
+        frame = frame.resize((frame.width * scale, frame.height * scale), Image.NEAREST)
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", help="Log of OSC commands to render")
+    parser.add_argument("-o", "--output", required=True, help="File to write the frames to")
+    parser.add_argument("--format", choices=FORMATS, default='show',
+                        help="raw RGB frames, animated PNG or GIF, or a show file for /play")
+    parser.add_argument("--width", type=int, default=60,
+                        help="Width of LED array")
+    parser.add_argument("--height", type=int, default=1,
+                        help="Height of LED array")
+    parser.add_argument("--period", type=float, default=0.05,
+                        help="Refresh period in seconds")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Seconds to render (default until 2s after the last command)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the random effects")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Pixels per LED in PNG and GIF output")
+    args = parser.parse_args()
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    fx.seed(args.seed)
+    cmds = read_log(args.log)
+    duration = args.duration
+    if duration is None:
+        duration = (cmds[-1][0] if cmds else 0) + 2
+    size = (args.width, args.height)
+    frames = render(cmds, size, args.period, duration)
+
+    if args.format == 'show':
+        writer = ShowWriter(args.output, size, args.period)
+        for frame in frames:
+            writer.add(frame)
+        writer.close()
+    elif args.format == 'raw':
+        with open(args.output, 'wb') as f:
+            for frame in frames:
+                if np is not None and not isinstance(frame, Image.Image):
+                    f.write(frame[..., :3].tobytes())
+                else:
+                    f.write(frame.convert('RGB').tobytes())
+    else:
+        # Animations have to be held in memory, since Pillow writes all their frames at once
+        images = [to_image(frame, args.scale) for frame in frames]
+        images[0].save(args.output, 'PNG' if args.format == 'png' else 'GIF', save_all=True,
+                       append_images=images[1:], duration=round(args.period * 1000), loop=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,50 @@
 from asyncio import get_event_loop
-from pythonosc import dispatcher, osc_server
+from pythonosc import dispatcher, osc_bundle, osc_server, udp_client
+from time import time as wall_time
+
+
+class BundleDispatcher(dispatcher.Dispatcher):
+    """Passes the messages of each bundle to bundle_handler together, with the time of its
+    timetag, instead of calling the handlers at that time (or sleeping until it, as some
+    versions of python-osc do). Queries mapped to their own handlers are still answered at once."""
+    def __init__(self, bundle_handler):
+        super().__init__()
+        self.bundle_handler = bundle_handler
+
+    def call_handlers_for_packet(self, data, client_address):
+        if not osc_bundle.OscBundle.dgram_is_bundle(data):
+            return super().call_handlers_for_packet(data, client_address)
+        try:
+            bundle = osc_bundle.OscBundle(data)
+        except osc_bundle.ParseError:
+            return []
+        bundles = {}
+        self._collect(bundle, client_address, wall_time(), bundles)
+        for time, messages in sorted(bundles.items()):
+            self.bundle_handler(time, messages)
+        return []
+
+    def _collect(self, bundle, client_address, now, bundles):
+        # Group the messages of a bundle and any nested in it by their timetags, kept as they are
+        # even if already past (OscPacket would replace those with the time it was parsed)
+        time = bundle.timestamp or now  # A timetag of 0 means immediately
+        for content in bundle:
+            if isinstance(content, osc_bundle.OscBundle):
+                self._collect(content, client_address, now, bundles)
+            elif content.address in self._map:
+                for handler in self.handlers_for_address(content.address):
+                    handler.invoke(client_address, content)
+            else:
+                bundles.setdefault(time, []).append((content.address, list(content.params)))
 
 
 class OSCServer:
-    def __init__(self, handler, port=5005, ip="0.0.0.0"):
+    def __init__(self, handler, port=5005, ip="0.0.0.0", queries=None, bundle_handler=None):
         self.addr = (ip, port)
-        self.dispatcher = dispatcher.Dispatcher()
+        if bundle_handler is None:
+            self.dispatcher = dispatcher.Dispatcher()
+        else:
+            self.dispatcher = BundleDispatcher(bundle_handler)
         # for k, v in handlers.items():
         #     if k[0] == '/':
         #         addr = k
@@ -13,8 +52,21 @@ class OSCServer:
         #         addr = '/' + k
         #     self.dispatcher.map(addr, v)
         self.dispatcher.set_default_handler(handler)
+        # Queries return a list of (address, args) messages to send back to the client
+        for addr, query in (queries or {}).items():
+            self.dispatcher.map(addr, self.reply, query, needs_reply_address=True)
         loop = get_event_loop()
         self.server = osc_server.AsyncIOOSCUDPServer(self.addr,
                                                      self.dispatcher,
                                                      loop)
         self.server.serve()
+
+    def reply(self, client, addr, query, *args):
+        # An int first argument is the port to reply to, if not the one the query came from
+        port = client[1]
+        if len(args) > 0 and isinstance(args[0], int):
+            port = args[0]
+            args = args[1:]
+        sender = udp_client.SimpleUDPClient(client[0], port)
+        for reply_addr, values in query[0](*args):
+            sender.send_message(reply_addr, values)
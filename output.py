@@ -0,0 +1,40 @@
+import threading
+
+
+class OutputThread(threading.Thread):
+    """Sends frames to the LEDs from a separate thread, so that a slow transfer doesn't block
+    the event loop. The frame being sent and the next pending frame form a double buffer:
+    if new frames arrive faster than they can be sent, only the newest one is kept."""
+    def __init__(self, send):
+        super().__init__(name='led-output', daemon=True)
+        self.send = send
+        self.cond = threading.Condition()
+        self.pending = None
+        self.running = True
+        self.sent = 0
+        self.skipped = 0
+
+    def submit(self, frame):
+        with self.cond:
+            if self.pending is not None:
+                self.skipped += 1
+            self.pending = frame
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                frame, self.pending = self.pending, None
+            self.send(frame)
+            self.sent += 1
+
+    def stop(self):
+        """Stop the thread once any pending frame has been sent"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.join()
@@ -0,0 +1,101 @@
+import multiprocessing
+import random
+import traceback
+from multiprocessing import shared_memory
+from PIL import Image
+
+
+def _worker(conn, name, size, rows, seed):
+    # Imported here so that the spawned process only loads what it needs
+    from controller import Controller
+    from fx import seed as fx_seed
+    # Every worker starts from the same random state and consumes it identically,
+    # so random effects stay in sync across the bands of the canvas
+    fx_seed(seed)
+    shm = shared_memory.SharedMemory(name=name)
+    top, bottom = rows
+    controller = Controller(size[0], bottom - top, 0, None, False, canvas=size, origin=(0, top))
+    start = top * size[0] * 4
+    end = bottom * size[0] * 4
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == 'frame':
+                shm.buf[start:end] = controller.render(msg[1]).tobytes()
+                conn.send((len(controller.layers), controller.retired))
+            elif msg[0] == 'osc':
+                try:
+                    controller.apply(*msg[1:])
+                except Exception:
+                    # Report a bad command and carry on, as the main process would
+                    traceback.print_exc()
+            elif msg[0] == 'stop':
+                break
+    finally:
+        shm.close()
+
+
+class ParallelRenderer:
+    """Renders the layers in several worker processes, each handling a band of rows of the canvas.
+    Effects are created in every worker from the same messages, and frames are returned
+    through shared memory."""
+    def __init__(self, size, workers, seed=None):
+        self.size = size
+        if seed is None:
+            seed = random.randrange(2**32)
+        workers = max(1, min(workers, size[1]))
+        bounds = [size[1] * i // workers for i in range(workers + 1)]
+        self.shm = shared_memory.SharedMemory(create=True, size=size[0] * size[1] * 4)
+        ctx = multiprocessing.get_context('spawn')
+        self.conns = []  # Connections to the workers still running
+        self.procs = []
+        self.names = {}
+        for rows in zip(bounds[:-1], bounds[1:]):
+            conn, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker, args=(child, self.shm.name, size, rows, seed),
+                               name='render-{}-{}'.format(*rows), daemon=True)
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+            self.names[conn] = proc.name
+        self.layers = 0
+        self.retired = 0
+
+    def message(self, addr, args, start_time=None):
+        for conn in list(self.conns):
+            self._send(conn, ('osc', addr, args, start_time))
+
+    def render(self, time):
+        conns = [conn for conn in list(self.conns) if self._send(conn, ('frame', time))]
+        counts = []
+        for conn in conns:
+            try:
+                counts.append(conn.recv())
+            except (EOFError, OSError):
+                self._lost(conn)
+        # All workers hold the same layers, so any one of them can report the counts
+        if counts:
+            self.layers, self.retired = counts[0]
+        return Image.frombytes('RGBA', self.size, self.shm.buf)
+
+    def _send(self, conn, msg):
+        try:
+            conn.send(msg)
+            return True
+        except OSError:
+            self._lost(conn)
+            return False
+
+    def _lost(self, conn):
+        # Keep going without a worker that has died, leaving its rows as they were
+        print("Render worker {} has stopped".format(self.names[conn]))
+        self.conns.remove(conn)
+        conn.close()
+
+    def close(self):
+        for conn in list(self.conns):
+            self._send(conn, ('stop',))
+        for proc in self.procs:
+            proc.join()
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,79 @@
+"""Drives both PWM channels of the Raspberry Pi from a single rpi_ws281x instance.
+The channels share one PWM block and DMA stream, so they have to be configured together:
+separate Adafruit_NeoPixel instances would each reinitialise the hardware over the other."""
+
+import atexit
+from neopixel import ws
+
+# The PWM channel driven by each GPIO pin that can output PWM
+PWM_PINS = {12: 0, 18: 0, 40: 0, 52: 0,
+            13: 1, 19: 1, 41: 1, 45: 1, 53: 1}
+
+
+class PWMChannel:
+    """One channel's LEDs, with the setPixelColor and numPixels of Adafruit_NeoPixel.
+    They are only sent when the PWMPixels they belong to is shown."""
+    def __init__(self, channel, num):
+        self.channel = channel
+        self.num = num
+
+    def numPixels(self):
+        return self.num
+
+    def setPixelColor(self, i, c):
+        if isinstance(i, slice):
+            for n, v in zip(range(*i.indices(self.num)), c):
+                ws.ws2811_led_set(self.channel, n, v)
+        else:
+            ws.ws2811_led_set(self.channel, i, c)
+
+
+class PWMPixels:
+    def __init__(self, freq, dma):
+        self.freq = freq
+        self.dma = dma
+        self._leds = ws.new_ws2811_t()
+        # Channels without an output are left switched off
+        for num in range(2):
+            chan = ws.ws2811_channel_get(self._leds, num)
+            ws.ws2811_channel_t_gpionum_set(chan, 0)
+            ws.ws2811_channel_t_invert_set(chan, 0)
+            ws.ws2811_channel_t_count_set(chan, 0)
+            ws.ws2811_channel_t_brightness_set(chan, 0)
+        ws.ws2811_t_freq_set(self._leds, freq)
+        ws.ws2811_t_dmanum_set(self._leds, dma)
+        self.channels = {}
+
+    def add_channel(self, num, pin, invert, brightness, strip_type):
+        """Set up the channel for an output of num LEDs on the pin, returning its PWMChannel"""
+        index = PWM_PINS[pin]
+        if index in self.channels:
+            raise ValueError("PWM channel {} is used by more than one output".format(index))
+        chan = ws.ws2811_channel_get(self._leds, index)
+        ws.ws2811_channel_t_gpionum_set(chan, pin)
+        ws.ws2811_channel_t_invert_set(chan, 1 if invert else 0)
+        ws.ws2811_channel_t_count_set(chan, num)
+        ws.ws2811_channel_t_brightness_set(chan, brightness)
+        ws.ws2811_channel_t_strip_type_set(chan, strip_type)
+        self.channels[index] = PWMChannel(chan, num)
+        return self.channels[index]
+
+    def begin(self):
+        resp = ws.ws2811_init(self._leds)
+        if resp != ws.WS2811_SUCCESS:
+            raise RuntimeError('ws2811_init failed with code {0} ({1})'.format(
+                resp, ws.ws2811_get_return_t_str(resp)))
+        atexit.register(self._cleanup)
+
+    def show(self):
+        """Send both channels"""
+        resp = ws.ws2811_render(self._leds)
+        if resp != ws.WS2811_SUCCESS:
+            raise RuntimeError('ws2811_render failed with code {0} ({1})'.format(
+                resp, ws.ws2811_get_return_t_str(resp)))
+
+    def _cleanup(self):
+        if self._leds is not None:
+            ws.ws2811_fini(self._leds)
+            ws.delete_ws2811_t(self._leds)
+            self._leds = None
@@ -0,0 +1,89 @@
+"""Files of pre-rendered frames: a header, then each frame as one packed Color word per LED,
+stored as little endian 32 bit integers in the order the pixels are sent to the strip"""
+
+import mmap
+import os
+import struct
+from functools import lru_cache
+from led import correction_table, pack
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'SPXL'
+VERSION = 1
+# Magic, version, width, height, padding, frame period in seconds, number of frames
+HEADER = struct.Struct('<4sHHHxxfI')
+
+
+class ShowWriter:
+    """Writes frames to a show file, filling in the frame count when closed.
+    The file is only replaced once complete, as it may be mapped by a running player."""
+    def __init__(self, path, size, period):
+        self.path = path
+        self.file = open(path + '.tmp', 'wb')
+        self.size = size
+        self.period = period
+        self.frames = 0
+        # Frames are stored uncorrected, so brightness and gamma still apply when played
+        self.table = correction_table()
+        self.file.write(self.header())
+
+    def header(self):
+        return HEADER.pack(MAGIC, VERSION, self.size[0], self.size[1], self.period, self.frames)
+
+    def add(self, image):
+        pix = pack(image, self.table)
+        if np is not None:
+            self.file.write(np.asarray(pix, '<u4').tobytes())
+        else:
+            self.file.write(struct.pack('<{}I'.format(len(pix)), *pix))
+        self.frames += 1
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.close()
+        os.replace(self.file.name, self.path)
+
+
+def read_header(data):
+    """Unpack the header at the start of a show file, returning ((w, h), period, frames)"""
+    magic, version, width, height, period, frames = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a show file")
+    if version != VERSION:
+        raise ValueError("Unsupported show file version: {}".format(version))
+    return (width, height), period, frames
+
+
+class Show:
+    """A show file mapped into memory, so frames are read straight from the page cache"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size, self.period, self.frames = read_header(self.data)
+        w, h = self.size
+        self.frame_bytes = w * h * 4
+        if len(self.data) < HEADER.size + self.frames * self.frame_bytes:
+            raise ValueError("Show file is truncated")
+        if np is not None:
+            # Viewed as bytes, each little endian Color word is B, G, R, W
+            self.pixels = np.frombuffer(self.data, np.uint8, self.frames * self.frame_bytes,
+                                        HEADER.size).reshape(self.frames, h, w, 4)
+
+    def frame(self, i):
+        """The raw bytes of frame i"""
+        start = HEADER.size + i * self.frame_bytes
+        return self.data[start:start + self.frame_bytes]
+
+
+@lru_cache(maxsize=8)
+def _open(path, mtime):
+    return Show(path)
+
+
+def open_show(path):
+    """Open a show file, reusing the mapping if the file hasn't changed since it was opened"""
+    return _open(path, os.stat(path).st_mtime)
@@ -7,7 +7,12 @@ import signal
 
 from osc import OSCServer
 from led import LEDStrip
+from mapping import Mapping
+from net import PROTOCOLS
+from urllib.parse import urlsplit
 from controller import Controller
+from offline import Recorder
+from stats import Profile
 
 
 if __name__ == "__main__":
@@ -25,13 +30,38 @@ if __name__ == "__main__":
                         choices=['rgb', 'rbg', 'grb', 'gbr',
                                  'brg', 'bgr', 'rgbw'])
     parser.add_argument("--kind", default="auto",
-                        choices=["auto", "fake", "real"])
+                        choices=["auto", "fake", "real", "null"])
     parser.add_argument("--width", type=int, default=60,
                         help="Width of LED array")
     parser.add_argument("--height", type=int, default=1,
                         help="Height of LED array")
     parser.add_argument("--period", type=float, default=0.05,
                         help="Refresh period in seconds")
+    parser.add_argument("--map",
+                        help="JSON file mapping the canvas to panels of LEDs on one or more "
+                             "outputs, instead of a single strip in row-major order")
+    parser.add_argument("--net",
+                        help="Send to a network node instead of a strip, as "
+                             "protocol://host[:port] with protocol one of: " +
+                             ', '.join(sorted(PROTOCOLS)))
+    parser.add_argument("--net-sync", action="store_true",
+                        help="Send sync packets after each frame to the network node")
+    parser.add_argument("--threaded", action="store_true",
+                        help="Send frames to the LEDs from a separate thread")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Render in this many processes, each handling a band of rows")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Lower the frame rate when rendering can't keep up")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time each stage of rendering, for querying with /stats")
+    parser.add_argument("--profile-file",
+                        help="Time each stage of rendering and append the results to this file")
+    parser.add_argument("--profile-interval", type=float, default=5,
+                        help="Seconds between writes to the profile file")
+    parser.add_argument("--record",
+                        help="Log the OSC commands received to this file, for offline.py")
+    parser.add_argument("--fake-fps", type=float, default=0,
+                        help="Maximum rate to redraw fake LEDs in the terminal (default no limit)")
     parser.add_argument("--debug", action="store_true",
                         help="Print some debugging output")
     parser.add_argument("--dma", type=int, default=5)
@@ -45,10 +75,27 @@ if __name__ == "__main__":
     if args.debug:
         print("Args:", args)
 
+    profile = None
+    if args.profile or args.profile_file:
+        profile = Profile(args.profile_file, args.profile_interval)
+
+    mapping = None
+    if args.map:
+        mapping = Mapping.load(args.map, (args.width, args.height))
+    elif args.net:
+        url = urlsplit(args.net)
+        if url.scheme not in PROTOCOLS:
+            parser.error("Unknown network protocol: " + url.scheme)
+        mapping = Mapping((args.width, args.height),
+                          [dict(protocol=url.scheme, host=url.hostname, port=url.port,
+                                sync=args.net_sync)],
+                          [dict(width=args.width, height=args.height)])
+
     try:
         leds = LEDStrip(args.kind, args.width * args.height, args.freq, args.gpio,
                         args.dma, args.channel, args.strip, args.invert,
-                        args.bright, args.gamma, args.debug)
+                        args.bright, args.gamma, args.debug, args.threaded, profile, mapping,
+                        args.width, args.fake_fps)
     except RuntimeError:
         if os.geteuid() != 0:
             print("Unable to initialise LED strip, you probably need to run with sudo")
@@ -56,21 +103,29 @@ if __name__ == "__main__":
         else:
             raise
 
-    controller = Controller(args.width, args.height, args.period, leds, args.debug)
+    controller = Controller(args.width, args.height, args.period, leds, args.debug,
+                            args.adaptive, args.workers, profile=profile)
     loop = asyncio.get_event_loop()
 
     def cleanup():
         loop.stop()
+        controller.close()
         if args.clear:
             if args.debug:
                 print()
             leds.clear()
+        leds.close()
         print("\nQuitting...")
     loop.add_signal_handler(signal.SIGINT, cleanup)
     loop.add_signal_handler(signal.SIGTERM, cleanup)
     print('Press Ctrl-C to quit')
 
-    server = OSCServer(controller.handler, args.port, args.ip)
+    handler, bundle_handler = controller.handler, controller.bundle
+    if args.record:
+        handler = Recorder(handler, args.record, loop.time, bundle_handler)
+        bundle_handler = handler.bundle
+    server = OSCServer(handler, args.port, args.ip, {'/stats': controller.stats}, bundle_handler)
+    controller.start()
 
     try:
         loop.run_forever()
@@ -0,0 +1,68 @@
+from collections import deque
+from time import time as wall_time
+import json
+
+
+class Timings:
+    """Keeps a rolling window of durations (in seconds) for reporting percentiles"""
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration):
+        self.samples.append(duration)
+        self.count += 1
+        self.total += duration
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(len(s) * p / 100.0))]
+
+    def summary(self, *percentiles):
+        """Format the given percentiles in milliseconds"""
+        return ' '.join('p{}: {:.2f}ms'.format(p, self.percentile(p) * 1000)
+                        for p in percentiles)
+
+    def histogram(self, percentiles=(50, 90, 99, 100)):
+        """The overall count and mean, and the given percentiles of the recent samples,
+        with durations in milliseconds"""
+        res = dict(count=self.count,
+                   mean=self.total * 1000 / self.count if self.count else 0.0)
+        res.update(('p{}'.format(p), self.percentile(p) * 1000) for p in percentiles)
+        return res
+
+
+class Profile:
+    """Timings of each stage of producing frames, by name.
+    If given a path, the histograms are appended to it as a line of JSON every interval seconds."""
+    def __init__(self, path=None, interval=5):
+        self.timings = {}
+        self.path = path
+        self.interval = interval
+        self.last_dump = None
+
+    def add(self, name, duration):
+        timings = self.timings.get(name)
+        if timings is None:
+            timings = self.timings[name] = Timings()
+        timings.add(duration)
+
+    def histograms(self):
+        return {name: t.histogram() for name, t in sorted(self.timings.items())}
+
+    def tick(self, now):
+        """Called once per frame with the current time, to dump the histograms when due"""
+        if self.path is None:
+            return
+        if self.last_dump is None:
+            self.last_dump = now
+        elif now - self.last_dump >= self.interval:
+            self.last_dump = now
+            self.dump()
+
+    def dump(self):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(time=wall_time(), stages=self.histograms())) + '\n')